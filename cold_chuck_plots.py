@@ -82,7 +82,7 @@ class ColdChuckPlots (PyHaHaPlot2):
             print(header)
         return header
 
-    def save_plot(self, filename=''):
+    def save_plot(self, filename='', rasterize=None):
         """
         Save the current plot in a file (mostly a .pdf-file).
 
@@ -90,6 +90,12 @@ class ColdChuckPlots (PyHaHaPlot2):
             If empty, the filename is calcuated with ccd.get_file_name() or -
             if a list of filenames is provided to the constructor - with the
             device name of the first file.
+
+        *rasterize* : integer, optional
+            If set, the data layers are rasterized with *rasterize* dpi
+            (see PyHaHaPlot2.rasterize_data()), axes and labels stay
+            vectors. Useful for long sweeps and many overlaid curves
+            saved as .pdf.
         """
         if (filename == ''):
             if (len(self._ccds) > 1):
@@ -100,7 +106,15 @@ class ColdChuckPlots (PyHaHaPlot2):
                            self. _plotparams_['savefig.format']
         else:
             savefile = filename
-        plt.savefig(savefile)
+        if rasterize is None:
+            plt.savefig(savefile)
+        else:
+            states = self.rasterize_data()
+            try:
+                plt.savefig(savefile, dpi=rasterize)
+            finally:
+                for artist, rasterized in states:
+                    artist.set_rasterized(rasterized)
         msg = "Plot saved as " + savefile
         print(msg)
 
@@ -138,7 +152,8 @@ class IVPlot(ColdChuckPlots):
             pass
         pass
 
-    def make_plot(self, labels=None, y_factor=1.0e9, y_unit='nA', with_GR=True):
+    def make_plot(self, labels=None, y_factor=1.0e9, y_unit='nA', with_GR=True,
+                  decimate=True):
         """
         Create a standard IV-plot.
         Note: After a previous call of set_voltage_index_range
@@ -160,6 +175,11 @@ class IVPlot(ColdChuckPlots):
 
         *with_GR* : bool, optional
             If True, include IV for the guard ring. Default is True
+
+        *decimate* : bool, optional
+            If True (default), long sweeps are reduced to the min/max
+            envelope per pixel of the saved figure before plotting
+            (see minmax_decimate()).
         """
         plt.title(self.make_title())
         if isinstance(labels, list):
@@ -171,14 +191,19 @@ class IVPlot(ColdChuckPlots):
             volts = ccd.get_volts()
             i_pad = np.abs(ccd.get_i_pad())  # in A
             i_gr = np.abs(ccd.get_i_gr())    # in A
+            if decimate:
+                volts_gr, i_gr = self.decimate(volts, i_gr)
+                volts, i_pad = self.decimate(volts, i_pad)
+            else:
+                volts_gr = volts
             if labels is None:
                 plt.plot(volts, y_factor*i_pad, label='Pad')
                 if with_GR:
-                    plt.plot(volts, y_factor*i_gr, label='GR')
+                    plt.plot(volts_gr, y_factor*i_gr, label='GR')
             else:
                 plt.plot(volts, y_factor*i_pad, label=my_labels[i] + ', Pad')
                 if with_GR:
-                    plt.plot(volts, y_factor*i_gr, label=my_labels[i] + ', GR')
+                    plt.plot(volts_gr, y_factor*i_gr, label=my_labels[i] + ', GR')
         plt.xlabel("Bias Voltage [V]")
         plt.ylabel("Current [" + y_unit + "]")
         plt.legend(loc='best')
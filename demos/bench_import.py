@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+##############################################################################
+# File:                bench_import.py
+# Created:             2026-10-19
+# License (CC BY 4.0): https://creativecommons.org/licenses/by/4.0/deed.de
+###############################################################################
+# Measures the start-up time of fresh Python processes which import pyhaha:
+# data-only (matplotlib and lxml are not loaded), and with matplotlib.pyplot
+# and lxml.etree loaded as well, which is what every import used to cost
+# before these modules were loaded lazily.
+# Usage:  python3 bench_import.py [repetitions]
+
+import subprocess
+import sys
+import time
+
+repetitions = 10
+if len(sys.argv) > 1:
+    repetitions = int(sys.argv[1])
+
+cases = [('python only', 'pass'),
+         ('data-only', 'from pyhaha import *'),
+         ('with plt + et', 'from pyhaha import *; plt.figure; et.parse'),
+        ]
+
+for name, code in cases:
+    times = []
+    for i in range(repetitions):
+        start_time = time.time()
+        subprocess.check_call([sys.executable, '-c', code])
+        times.append(time.time() - start_time)
+    times.sort()
+    print("{:15s} median {:8.1f} ms   min {:8.1f} ms".format(name, \
+          1e3 * times[len(times) // 2], 1e3 * times[0]))
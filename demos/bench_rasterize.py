@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+##############################################################################
+# File:                bench_rasterize.py
+# Created:             2026-10-19
+# License (CC BY 4.0): https://creativecommons.org/licenses/by/4.0/deed.de
+###############################################################################
+# Compares file size and save time of plots saved as .pdf with vector data
+# and with rasterized data layers (save_plot(rasterize=...)).
+# Usage:  python3 bench_rasterize.py [scope-basename [data_dir]]
+
+from pyhaha import *                   # Environment variable $PYTHONPATH
+                                       # points to relevant folder
+import time
+
+data_dir = './data_dir'                # .iv file and default scope run
+filename = '03_20GSs_400ns_49807_raw'  # the Base-Name of a scope run
+iv_file = 'FTH200N_04_DiodeS_14_2015-11-06_7.iv'
+scope_dir = data_dir
+if len(sys.argv) > 1:
+    filename = sys.argv[1]
+if len(sys.argv) > 2:
+    scope_dir = sys.argv[2]
+
+def bench(p, make_plot, name):
+    for rasterize in [None, 150, 300]:
+        plt.close('all')
+        make_plot()
+        outfile = 'bench_{}_{}.pdf'.format(name, rasterize or 'vector')
+        start_time = time.time()
+        p.save_plot(outfile, rasterize=rasterize)
+        save_time = time.time() - start_time
+        print("{:10s} rasterize={:6s} {:10.1f} kB {:8.2f} s".format(name, \
+              str(rasterize), os.path.getsize(outfile) / 1024, save_time))
+        os.remove(outfile)
+
+ccd = ColdChuckData(iv_file, data_dir)
+p = IVPlot(ccd)
+bench(p, p.make_plot, 'iv')
+if os.path.isfile(os.path.join(scope_dir, filename + '.bin')):
+    sd = ScopeData(filename, scope_dir)
+    p = WaveformPlot(sd)
+    bench(p, lambda: p.make_plot(data_max=1000), 'waveform')
+    p = SpectrumPlot(sd)
+    rl = sd.get_props()['RecordLength']
+    bench(p, lambda: p.make_plot(0, rl - 1), 'spectrum')
+else:
+    print('Scope run "{}" not found in "{}"'.format(filename, scope_dir))
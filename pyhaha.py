@@ -27,14 +27,21 @@ The following modules are required and will always be loaded:
 * numpy as np (for multidimensional arrays, linear algebra, ...)
 * cmath
 * collections (for OrderedDict)
-* lxml.etree as et (for XML parsers)
-* matplotlib.pyplot as plt
-* matplotlib.colors as colors
 * string
 * io
 * datetime
 * time
 
+The following modules are loaded lazily, i.e. only when they are used
+for the first time (e.g. by a plot class or when a header-file of
+ScopeData is parsed), so that data-only jobs and worker processes start
+fast. The names are available as usual:
+
+* lxml.etree as et (for XML parsers)
+* matplotlib.pyplot as plt
+* matplotlib.colors as colors
+* matplotlib.collections as mcollections
+
 The following project modules are imported:
 
 * cold_chuck_tools.py
@@ -51,14 +58,42 @@ import csv              # for CSV files
 import numpy as np      # NumPy (multidimensional arrays, linear algebra, ...)
 import cmath            # complex math
 import collections
-import lxml.etree as et  # for XML parsing
-import matplotlib.pyplot as plt
-import matplotlib.colors as colors
+import importlib
+import types
 import string
 import io
 import datetime
 import time
 
+class _LazyModule(types.ModuleType):
+    # Placeholder for a module which is imported on the first access
+    # of one of its attributes, e.g. plt.plot(...)
+
+    def __init__(self, name):
+        types.ModuleType.__init__(self, name)
+        self.__dict__['_lazy_module'] = None
+
+    def _load(self):
+        module = self.__dict__['_lazy_module']
+        if module is None:
+            module = importlib.import_module(self.__name__)
+            self.__dict__['_lazy_module'] = module
+        return module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self._load(), attr, value)
+
+    def __dir__(self):
+        return dir(self._load())
+
+et = _LazyModule('lxml.etree')                    # for XML parsing
+plt = _LazyModule('matplotlib.pyplot')
+colors = _LazyModule('matplotlib.colors')
+mcollections = _LazyModule('matplotlib.collections')
+
 from cold_chuck_tools import *
 from transient_tools import *
 from pyhaha_plots import *
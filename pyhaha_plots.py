@@ -12,8 +12,9 @@
 u"""
 Module: pyhaha_plots
 ********************
-The module pyhaha_plots.py only contains the class PyHaHaPlot2 which is
-the superclass class for other plot classes.  The picture below illustrates
+The module pyhaha_plots.py contains the class PyHaHaPlot2 which is
+the superclass class for other plot classes, and the function
+minmax_decimate used by these classes.  The picture below illustrates
 the class hierarchy:
 
 .. figure:: class_hierarchy.png
@@ -22,6 +23,9 @@ the class hierarchy:
 It is not intended to instanciate PyHaHaPlot2 directly.
 """
 from pyhaha import *
+import ast
+
+_PLOTPARAMS_CACHE = {}      # abspath -> (mtime, size, parameters)
 
 class PyHaHaPlot2():
     """
@@ -54,7 +58,7 @@ class PyHaHaPlot2():
         self.load_plotparams(plotparams_file)
         if plotparams is not None:
             PyHaHaPlot2._plotparams_.update(plotparams)
-            plt.rcParams.update(plotparams)
+            _update_rcparams(plotparams)
         pass
 
     def get_plotparams(self):
@@ -74,7 +78,7 @@ class PyHaHaPlot2():
             and meaning of the entries.
         """
         PyHaHaPlot2._plotparams_.update(plotparams)
-        plt.rcParams.update(plotparams)
+        _update_rcparams(plotparams)
 
     def load_plotparams(self, plotparams_file="pyhaha_plot_defaults"):
         """
@@ -87,15 +91,163 @@ class PyHaHaPlot2():
             If empty, the dictionary is read from the
             file ``pyhaha_plot_defaults``, otherwise you can define your
             plot parameters in a file of your own.
+
+        The file must contain a dictionary of literals (strings, numbers,
+        lists, ...), it is parsed with ``ast.literal_eval()``. The parsed
+        dictionary is cached and the file is only read again when its
+        modification time or size has changed. Only the parameters which
+        differ from the active ``plt.rcParams`` are updated.
         """
         try:
-            fi = open(plotparams_file, 'r')
-            PyHaHaPlot2._plotparams_ = eval(fi.read())
-            fi.close()
-        except(IOError):
+            path = os.path.abspath(plotparams_file)
+            stat = os.stat(path)
+            cached = _PLOTPARAMS_CACHE.get(path)
+            if cached is None or cached[:2] != (stat.st_mtime, stat.st_size):
+                with open(path, 'r') as fi:
+                    params = ast.literal_eval(fi.read())
+                if not isinstance(params, dict):
+                    raise ValueError('not a dictionary')
+                cached = (stat.st_mtime, stat.st_size, params)
+                _PLOTPARAMS_CACHE[path] = cached
+        except(IOError, OSError):
             msg = 'ERROR! Class PyHaHaPlot2 could not be instanciated:\n' +\
                    'File "{}" could not be opened'.format(plotparams_file)
             sys.exit(msg)
-        plt.rcParams.update(PyHaHaPlot2._plotparams_)
+        except(ValueError, SyntaxError) as err:
+            msg = 'ERROR! Class PyHaHaPlot2 could not be instanciated:\n' +\
+                   'File "{}" could not be parsed: {}'.format(plotparams_file, \
+                   err)
+            sys.exit(msg)
+        PyHaHaPlot2._plotparams_ = dict(cached[2])
+        _update_rcparams(PyHaHaPlot2._plotparams_)
         return None
 
+    def rasterize_data(self, fig=None):
+        """
+        Marks the data layers (lines, collections, images and patches)
+        of all axes of a figure to be rasterized when the figure is saved
+        in a vector format (.pdf, .svg, .eps), while axes, ticks, labels,
+        legends and the title stay vectors. For plots with many samples
+        this makes the files much smaller and faster to write and to open.
+        The resolution is the *dpi* passed to ``plt.savefig()``.
+        The flags stay set until they are restored with the returned list,
+        which should be done after saving, e.g.::
+
+            states = self.rasterize_data()
+            try:
+                plt.savefig('plot.pdf', dpi=150)
+            finally:
+                for artist, rasterized in states:
+                    artist.set_rasterized(rasterized)
+
+        *fig* : matplotlib Figure, optional
+            Defaults to the current figure.
+
+        *return* : list of (artist, boolean)
+            Each changed artist with its previous rasterized flag.
+        """
+        if fig is None:
+            fig = plt.gcf()
+        states = []
+        for ax in fig.get_axes():
+            for artist in ax.lines + ax.collections + ax.images + ax.patches:
+                states.append((artist, artist.get_rasterized()))
+                artist.set_rasterized(True)
+        return states
+
+    def get_pixel_width(self, ax=None):
+        """
+        *ax* : matplotlib Axes, optional
+            Defaults to the current axes.
+
+        *return* : integer
+            The width of the axes in pixels of the saved figure (rcParam
+            'savefig.dpi', or the figure dpi if this is 'figure').
+        """
+        if ax is None:
+            ax = plt.gca()
+        fig = ax.get_figure()
+        dpi = plt.rcParams['savefig.dpi']
+        if not isinstance(dpi, (int, float)):
+            dpi = fig.dpi
+        width = ax.get_position().width * fig.get_size_inches()[0] * dpi
+        return max(int(np.ceil(width)), 1)
+
+    def decimate(self, x, y, ax=None):
+        """
+        Reduces traces to their min/max envelope with one bin per pixel
+        of the axes, see minmax_decimate() and get_pixel_width().
+
+        *x*, *y* : numpy arrays
+            See minmax_decimate().
+
+        *ax* : matplotlib Axes, optional
+            Defaults to the current axes.
+
+        *return* : two numpy arrays
+            The decimated *x* and *y*.
+        """
+        return minmax_decimate(x, y, self.get_pixel_width(ax))
+
+def _update_rcparams(params):
+    # Updates only those plt.rcParams which differ from *params*, values
+    # are compared after the validation done by matplotlib.
+    changed = {}
+    for key, value in params.items():
+        try:
+            if plt.rcParams[key] == plt.rcParams.validate[key](value):
+                continue
+        except (KeyError, ValueError, TypeError, AttributeError):
+            pass
+        changed[key] = value
+    if changed:
+        plt.rcParams.update(changed)
+    return None
+
+def minmax_decimate(x, y, n_bins):
+    """
+    Reduces a trace (or many traces of the same length) with more
+    samples than pixels to the minimum and maximum of each of *n_bins*
+    bins of consecutive samples, in their original order. A line through
+    the decimated points looks like the full trace at this resolution:
+    peaks and the noise band are preserved, but only 2 * *n_bins* points
+    per trace have to be drawn.
+
+    *x* : numpy array
+        The x-values, either one line (the same for all traces) or one
+        line per trace.
+
+    *y* : numpy array
+        One trace, or one trace per line.
+
+    *n_bins* : integer
+        Number of bins, e.g. the width of the plot in pixels.
+
+    *return* : two numpy arrays
+        The decimated *x* (one line per trace if *y* is 2-dimensional)
+        and *y*. Traces with at most 2 * *n_bins* samples are returned
+        unchanged.
+    """
+    x = np.asarray(x)
+    y = np.asarray(y)
+    n = y.shape[-1]
+    if n <= 2 * n_bins:
+        return x, y
+    k = -(-n // n_bins)                       # samples per bin
+    nb = -(-n // k)
+    # pad with the last sample, which changes neither min nor max
+    pad = nb * k - n
+    yp = np.concatenate([y, np.repeat(y[..., -1:], pad, axis=-1)], axis=-1)
+    yb = yp.reshape(y.shape[:-1] + (nb, k))
+    start = np.arange(nb) * k
+    i_min = yb.argmin(axis=-1) + start
+    i_max = yb.argmax(axis=-1) + start
+    idx = np.empty(i_min.shape[:-1] + (2 * nb,), dtype=np.intp)
+    idx[..., 0::2] = np.minimum(i_min, i_max)
+    idx[..., 1::2] = np.maximum(i_min, i_max)
+    y_dec = np.take_along_axis(y, idx, axis=-1)
+    if x.ndim == 1:
+        x_dec = x[idx]
+    else:
+        x_dec = np.take_along_axis(x, idx, axis=-1)
+    return x_dec, y_dec
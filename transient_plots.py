@@ -26,6 +26,7 @@ The module contains the classes:
 * class TransientPlots (PyHaHaPlot2)
 * class WaveformPlot (TransientPlots)
 * class SpectrumPlot (TransientPlots)
+* class MonitorPlot (TransientPlots)
 
 """
 from pyhaha import *
@@ -44,6 +45,8 @@ class TransientPlots(PyHaHaPlot2):
         All have to be instances of class ScopeData
         otherwise Python will exit with an error message.
         **Note**: The current version only supports one instance.
+        To plot several data-files of a campaign together, combine them
+        in one instance of ScopeDataSet.
 
     *plotparams* : dictionary, optional
         This parameter is passed to the constructor of the class
@@ -75,7 +78,7 @@ class TransientPlots(PyHaHaPlot2):
         header = self._sds[0].get_basename()
         return header
 
-    def save_plot(self, filename=''):
+    def save_plot(self, filename='', rasterize=None):
         """
         Save the current plot in a file (mostly a .pdf-file).
 
@@ -83,11 +86,25 @@ class TransientPlots(PyHaHaPlot2):
             If empty, the filename is calcuated with ccd.get_file_name() or -
             if a list of filenames is provided to the constructor - with the
             device name of the first file.
+
+        *rasterize* : integer, optional
+            If set, the data layers are rasterized with *rasterize* dpi
+            (see PyHaHaPlot2.rasterize_data()), axes and labels stay
+            vectors. Recommended for multi-waveform and spectrum plots
+            saved as .pdf.
         """
         if filename == '':
             filename = self._sds[0].get_basename() + '.' + \
                 self._plotparams_['savefig.format']
-        plt.savefig(filename)
+        if rasterize is None:
+            plt.savefig(filename)
+        else:
+            states = self.rasterize_data()
+            try:
+                plt.savefig(filename, dpi=rasterize)
+            finally:
+                for artist, rasterized in states:
+                    artist.set_rasterized(rasterized)
         msg = "Plot saved as " + filename
         print(msg)
 
@@ -125,7 +142,9 @@ class WaveformPlot(TransientPlots):
 
     def make_plot(self, data_slot=None, data_max=100, \
                   x_factor=1.0e9, x_unit='ns', \
-                  y_factor=1.0e3, y_unit='mV'):
+                  y_factor=1.0e3, y_unit='mV', indices=None, \
+                  preview=None, seed=None, color=None, color_values=None, \
+                  cmap='viridis', linewidth=0.1, decimate=True):
         """
         Create a ROHDE & SCHWARZ Multiwafeform Plot.
 
@@ -156,24 +175,97 @@ class WaveformPlot(TransientPlots):
             *y_factor*, defaults to 'mV'. The string can contain
             Latex Code, a call to this method could be for instance
             ``make_plot(x_factor=1.0e6, x_unit=r"$\mu$V")``.
+
+        *indices* : list or numpy array of integers, optional
+            If set: Plot the records with these indices (e.g. the result
+            of ScopeData.select_records()) instead of the first *data_max*
+            records. Only these records are read from the data-file.
+
+        *preview* : integer, optional
+            If set (and *indices* is None): Plot a uniform random sample
+            of *preview* records from the whole run (see
+            ScopeData.sample_records()) instead of the first records.
+            Only the sampled records are read, which gives a quick and
+            representative look at a long run.
+
+        *seed* : integer, optional
+            Seed for the random sample of *preview*.
+
+        *color* : color or list of colors, optional
+            One color for all records or one color per record,
+            defaults to the first color of the color cycle.
+
+        *color_values* : list or numpy array of float, optional
+            One value per record (e.g. the amplitude from
+            ScopeData.get_features()), mapped to a color with *cmap*;
+            a colorbar is added. Overrides *color*.
+
+        *cmap* : string, optional
+            Colormap for *color_values*, defaults to 'viridis'.
+
+        *linewidth* : float, optional
+            Line width, defaults to 0.1.
+
+        *decimate* : bool, optional
+            If True (default), each record is reduced to the min/max
+            envelope per pixel of the saved figure before plotting (see
+            minmax_decimate()), so the drawing time depends on the width
+            of the figure, not on the record length. Use False to zoom
+            into the details of the records interactively.
+
+        All records are drawn as one LineCollection (one line per record),
+        which is fast also for thousands of overlaid records. Each line
+        holds its own copy of the time axis, so the memory grows with
+        records times samples per record; use *preview* and *decimate* to
+        limit it for long runs.
         """
         XStart = self._props['XStart']
         XStop = self._props['XStop']
         RecordLength = self._props['RecordLength']
-        data = self._sds[0].get_data()
+        if data_slot is not None:
+            data = self._sds[0].get_data([data_slot])
+            data_slot = 0
+        elif indices is not None or preview is not None:
+            if indices is None:
+                indices = self._sds[0].sample_records(preview, seed=seed)
+            data = self._sds[0].get_data(indices)
+            data_max = len(data)
+        else:
+            count = self._sds[0].get_record_count()
+            data = self._sds[0].get_data(np.arange(min(data_max, count)))
+            data_max = len(data)
         plt.title(self.make_title())
         plt.xlabel("Time [" + x_unit + "]")
         plt.ylabel("Voltage [" + y_unit + "]")
         plt.grid(True)
+        xaxis = x_factor * np.linspace(XStart, XStop, RecordLength)
         if data_slot is None:             # Spectrum plot
-            xaxisrepeat = np.tile(x_factor * \
-                    np.linspace(XStart, XStop, RecordLength), \
-                    data_max)
-            plt.plot(xaxisrepeat, y_factor * data[0 : data_max].flatten(), \
-                    linewidth=0.1)
+            x, y = xaxis, data[0 : data_max]
+            if decimate:
+                x, y = self.decimate(x, y)
+            # one (samples, 2) segment per record, float32 to halve the
+            # temporary buffer (LineCollection copies the segments anyway)
+            segments = np.empty(y.shape + (2,), dtype=np.float32)
+            segments[:, :, 0] = x
+            np.multiply(y, y_factor, out=segments[:, :, 1], casting='unsafe')
+            lines = mcollections.LineCollection(segments, \
+                    linewidths=linewidth)
+            del segments
+            if color_values is not None:
+                lines.set_array(np.asarray(color_values)[0 : data_max])
+                lines.set_cmap(cmap)
+            else:
+                lines.set_color('C0' if color is None else color)
+            ax = plt.gca()
+            ax.add_collection(lines)
+            ax.autoscale_view()
+            if color_values is not None:
+                plt.colorbar(lines, ax=ax)
         else:                         # Single plot
-            xaxis = x_factor * np.linspace(XStart, XStop, RecordLength)
-            plt.plot(xaxis, y_factor * data[data_slot].flatten(), linewidth=0.1)
+            x, y = xaxis, data[data_slot].flatten()
+            if decimate:
+                x, y = self.decimate(x, y)
+            plt.plot(x, y_factor * y, linewidth=linewidth, color=color)
 
 
 class SpectrumPlot(TransientPlots):
@@ -210,7 +302,7 @@ class SpectrumPlot(TransientPlots):
 
     def make_plot(self, idx_min=2200, idx_max=3500, \
                   x_factor=1.0e9, x_unit='ns', \
-                  y_factor=1.0e3, y_unit='mV'):
+                  y_factor=1.0e3, y_unit='mV', hist=None, indices=None):
         """
         Create a spectrum plot.
 
@@ -241,32 +333,282 @@ class SpectrumPlot(TransientPlots):
             *y_factor*, defaults to 'mV'. The string can contain
             Latex Code, a call to this method could be for instance
             ``make_plot(x_factor=1.0e6, x_unit=r"$\mu$V")``.
+
+        *hist* : PersistenceHistogram, optional
+            A histogram which has been accumulated before (for instance
+            merged from several processes or runs). If None, the histogram
+            is created from the ScopeData object chunk by chunk.
+
+        *indices* : list or numpy array of integers, optional
+            If set (and *hist* is None): Only the records with these
+            indices are histogrammed, e.g. the result of
+            ScopeData.select_records().
+
+        For scopes with more than 8 bit a sparse histogram is created and
+        only the occupied range of ADC levels is shown. To reduce the
+        resolution, create the histogram with
+        ``ScopeData.get_persistence_histogram(code_bin=...)``.
         """
-        XStart = self._props['XStart']
-        XStop = self._props['XStop']
-        RecordLength = self._props['RecordLength']
-        rawdata = self._sds[0].get_rawdata()
+        if hist is None:
+            hist = self._sds[0].get_persistence_histogram(indices=indices)
 
         plt.title(self.make_title())
         plt.xlabel("Time [" + x_unit + "]")
         plt.ylabel("Voltage [" + y_unit + "]")
 
+        screen, extent, zmax = self._image_data(hist, idx_min, idx_max, \
+                                                x_factor, y_factor)
+        print("idx_min:\t\t%d\t%.2e" % (idx_min, extent[0]))
+        print("idx_max:\t\t%d\t%.2e" % (idx_max, extent[1]))
+        print("zmax:\t\t%d\n" % zmax)
+        plt.imshow(screen.T, aspect='auto', \
+                   interpolation='bilinear', cmap='hot', origin='lower', \
+                   extent=extent, norm=colors.LogNorm(vmin=1, vmax=zmax))
+        plt.colorbar()
+
+    def _image_data(self, hist, idx_min, idx_max, x_factor, y_factor):
+        # Screen, extent and maximum count for the image of a histogram
         xaxis = x_factor * np.linspace(self._props['XStart'], \
                         self._props['XStop'], self._props['RecordLength'])
-        yaxis = y_factor * (np.linspace(-128, 127, 256) * \
+        bin_min, bin_max = hist.get_bin_range()
+        yaxis = y_factor * (hist.get_levels(bin_min, bin_max) * \
             self._props['ConversionFactor'] + self._props['ConversionOffset'])
-        screen = np.ones((RecordLength, 256), dtype=np.int16)
-        for x in range(0, RecordLength - 1):
-            unique, counts = np.unique(rawdata['sig'][:,x], return_counts=True)
-            for i, val in enumerate(unique, 0):
-                screen[x, val+128] = counts[i]
-        zmax = screen.max()
-        print("idx_min:\t\t%d\t%.2e" % (idx_min, xaxis[idx_min]))
-        print("idx_max:\t\t%d\t%.2e" % (idx_max, xaxis[idx_max]))
-        print("zmax:\t\t%d\n" % zmax)
-        plt.imshow(screen[idx_min:idx_max,:].T, aspect='auto', \
+        screen = hist.get_screen(idx_min, idx_max, bin_min, bin_max)
+        extent = [xaxis[idx_min], xaxis[idx_max], yaxis[0], yaxis[-1]]
+        return screen, extent, hist.get_max()
+
+    def make_zoom_plot(self, pyramid=None, idx_min=0, idx_max=None, \
+                       max_columns=None, x_factor=1.0e9, x_unit='ns', \
+                       y_factor=1.0e3, y_unit='mV'):
+        """
+        Create a spectrum plot from a multi-resolution pyramid of
+        persistence histograms (see class HistogramPyramid). For the shown
+        window of samples the coarsest level with enough columns is used,
+        and when the x-axis is panned or zoomed interactively, only the
+        new window of that level is read from disk.
+
+        *pyramid* : HistogramPyramid, optional
+            The pyramid to be shown. If None, it is taken from
+            ScopeData.get_pyramid(), which builds it (one streaming pass
+            over the run) only if there is no valid pyramid on disk.
+
+        *idx_min*, *idx_max* : integer, optional
+            Initial range of samples, defaults to the full record.
+
+        *max_columns* : integer, optional
+            Maximum number of columns of the image, defaults to the width
+            of the figure in pixels.
+
+        *x_factor*, *x_unit*, *y_factor*, *y_unit* :
+            See make_plot().
+
+        *return* : HistogramPyramid
+            The pyramid shown.
+        """
+        if pyramid is None:
+            pyramid = self._sds[0].get_pyramid()
+        rl = self._props['RecordLength']
+        if idx_max is None:
+            idx_max = rl
+        xstart = self._props['XStart']
+        dt = (self._props['XStop'] - xstart) / max(rl - 1, 1)
+        yaxis = y_factor * (pyramid.get_adc_levels() * \
+            self._props['ConversionFactor'] + self._props['ConversionOffset'])
+        fig = plt.gcf()
+        if max_columns is None:
+            max_columns = int(fig.get_size_inches()[0] * fig.dpi)
+        zmax = max(pyramid.get_max(), 1)
+
+        def window(i_min, i_max):
+            counts, first, step = pyramid.get_window(i_min, i_max, max_columns)
+            extent = [x_factor * (xstart + first * dt), \
+                      x_factor * (xstart + (first + len(counts) * step) * dt), \
+                      yaxis[0], yaxis[-1]]
+            # counts per sample, so that all levels share one color scale
+            return np.maximum(counts / float(step), 1), extent
+
+        plt.title(self.make_title())
+        plt.xlabel("Time [" + x_unit + "]")
+        plt.ylabel("Voltage [" + y_unit + "]")
+        screen, extent = window(idx_min, idx_max)
+        image = plt.imshow(screen.T, aspect='auto', \
                    interpolation='bilinear', cmap='hot', origin='lower', \
-                   extent=[xaxis[idx_min], xaxis[idx_max], \
-                   yaxis[0], yaxis[255]], \
-                   norm=colors.LogNorm(vmin=1, vmax=zmax))
+                   extent=extent, norm=colors.LogNorm(vmin=1, vmax=zmax))
         plt.colorbar()
+        ax = plt.gca()
+        ax.set_xlim(x_factor * (xstart + idx_min * dt), \
+                    x_factor * (xstart + idx_max * dt))
+        ax.set_autoscale_on(False)
+
+        def on_xlim_changed(ax):
+            x0, x1 = ax.get_xlim()
+            i_min = int(np.floor((x0 / x_factor - xstart) / dt))
+            i_max = int(np.ceil((x1 / x_factor - xstart) / dt)) + 1
+            screen, extent = window(i_min, i_max)
+            image.set_data(screen.T)
+            image.set_extent(extent)
+
+        ax.callbacks.connect('xlim_changed', on_xlim_changed)
+        return pyramid
+
+    def make_live_plot(self, idx_min=2200, idx_max=3500, interval=1.0, \
+                       timeout=None, max_updates=None, \
+                       x_factor=1.0e9, x_unit='ns', \
+                       y_factor=1.0e3, y_unit='mV', hist=None):
+        """
+        Create a spectrum plot which follows a data-file while it is
+        written by the scope. Every *interval* seconds the size of the
+        data-file is checked, only the complete records added since the
+        last check are read and added to the histogram, and the image is
+        updated in place. Hence the cost of an update is proportional to
+        the new data, not to the size of the data-file. The data-file is
+        always read directly, raw data cached with get_rawdata() are not
+        used because they do not contain the new records.
+        The method returns when no new records arrived for *timeout*
+        seconds, after *max_updates* updates, or when the plot window is
+        closed.
+
+        *idx_min*, *idx_max*, *x_factor*, *x_unit*, *y_factor*, *y_unit* :
+            See make_plot().
+
+        *interval* : float, optional
+            Time between two checks of the data-file in seconds,
+            defaults to 1.0.
+
+        *timeout* : float, optional
+            Stop if no new records arrived for *timeout* seconds,
+            defaults to None (no timeout).
+
+        *max_updates* : integer, optional
+            Stop after *max_updates* updates of the image,
+            defaults to None (no limit).
+
+        *hist* : PersistenceHistogram, optional
+            A histogram to be continued, for instance one returned by a
+            previous call. Its records are assumed to be the first records
+            of the data-file. If None, a new histogram is created.
+
+        *return* : PersistenceHistogram
+            The histogram of all records read so far.
+        """
+        sd = self._sds[0]
+        if hist is None:
+            hist = sd.new_persistence_histogram()
+        done = hist.get_records()
+        plt.title(self.make_title())
+        plt.xlabel("Time [" + x_unit + "]")
+        plt.ylabel("Voltage [" + y_unit + "]")
+        fig = plt.gcf()
+        image = None
+        updates = 0
+        last_data = time.time()
+        while True:
+            count = sd._get_file_record_count()
+            if count > done:
+                for first, chunk in sd._iter_file(start=done, stop=count):
+                    hist.fill(chunk['sig'])
+                done = count
+                last_data = time.time()
+                screen, extent, zmax = self._image_data(hist, idx_min, \
+                    idx_max, x_factor, y_factor)
+                if image is None:
+                    image = plt.imshow(screen.T, aspect='auto', \
+                        interpolation='bilinear', cmap='hot', \
+                        origin='lower', extent=extent, \
+                        norm=colors.LogNorm(vmin=1, vmax=zmax))
+                    plt.colorbar()
+                else:
+                    image.set_data(screen.T)
+                    image.set_extent(extent)
+                    image.set_clim(1, zmax)
+                updates += 1
+                fig.canvas.draw_idle()
+            if max_updates is not None and updates >= max_updates:
+                break
+            if timeout is not None and time.time() - last_data > timeout:
+                break
+            if not plt.fignum_exists(fig.number):
+                break
+            plt.pause(interval)
+        return hist
+
+class MonitorPlot(TransientPlots):
+    """
+    This class plots the running conditions of a run over the record
+    number (baseline drift, noise, pulse amplitude and occupancy), see
+    ScopeData.get_monitor(). Only the compact monitor is needed, hence
+    the plot is fast also for very long runs and can be made from a
+    saved monitor without reading the waveform data.
+    The parameter provided to the constructor has the following meaning:
+
+    *sds* : object or list of objects
+        One or several instances of class ScopeData
+        **Note**: The current version only supports one instance.
+
+    *plotparams* : dictionary, optional
+        This parameter is passed to the constructor of the class
+        ``PyHaHaPlot2``. See documentation of that class.
+
+    *plotparams_file* : string, optional
+        This parameter is passed to the constructor of the class
+        ``PyHaHaPlot2``. See documentation of that class.
+    """
+    def __init__(self, sds,
+                 plotparams=None, plotparams_file="pyhaha_plot_defaults"):
+#        print("MonitorPlot.__init__")
+        TransientPlots.__init__(self, sds, plotparams, plotparams_file)
+
+    def make_plot(self, monitor=None, quantity='baseline', \
+                  y_factor=1.0e3, y_unit='mV', **kwargs):
+        """
+        Create a monitor plot of one quantity over the record number.
+
+        *monitor* : numpy array of MONITOR_DTYPE, optional
+            A monitor calculated before, e.g. with load_monitor(). If None,
+            it is calculated with ``ScopeData.get_monitor(**kwargs)``.
+
+        *quantity* : string, optional
+            One of 'baseline' (mean and spread, default), 'noise',
+            'amplitude' (the quantiles MONITOR_QUANTILES) or 'occupancy'
+            (in percent, *y_factor* and *y_unit* are not used).
+
+        *y_factor* : float, optional
+            Multiplies the voltages with *y_factor* before
+            creating the plot, defaults to 1.0e3.
+
+        *y_unit* : string, optional
+            Sets the unit for the y-axis, should be based on the inverse of
+            *y_factor*, defaults to 'mV'.
+
+        *kwargs* : optional
+            Passed to ScopeData.get_monitor() if *monitor* is None,
+            e.g. *window* or *threshold*.
+        """
+        if monitor is None:
+            monitor = self._sds[0].get_monitor(**kwargs)
+        x = monitor['record']
+        plt.title(self.make_title())
+        plt.xlabel("Record")
+        plt.grid(True)
+        if quantity == 'baseline':
+            plt.ylabel("Baseline [" + y_unit + "]")
+            mean = y_factor * monitor['baseline']
+            std = y_factor * monitor['baseline_std']
+            plt.fill_between(x, mean - std, mean + std, step='post', \
+                             alpha=0.3, linewidth=0)
+            plt.step(x, mean, where='post')
+        elif quantity == 'noise':
+            plt.ylabel("Baseline RMS [" + y_unit + "]")
+            plt.step(x, y_factor * monitor['noise'], where='post')
+        elif quantity == 'amplitude':
+            plt.ylabel("Amplitude [" + y_unit + "]")
+            for i, q in enumerate(MONITOR_QUANTILES):
+                plt.step(x, y_factor * monitor['amplitude'][:, i], \
+                         where='post', label='{:g} %'.format(100 * q))
+            plt.legend(loc='best')
+        elif quantity == 'occupancy':
+            plt.ylabel("Occupancy [%]")
+            plt.step(x, 100 * monitor['occupancy'], where='post')
+        else:
+            msg = '??? MonitorPlot ERROR: unknown quantity "{}"'
+            raise ValueError(msg.format(quantity))
@@ -25,19 +25,80 @@ The module defines the global constants:
 * M_DATA_DIR (= '~/m_data/' which shold be s symlink to a gvfs share)
 * RD_DATA_DIR (= '/scratch_nmsamba/' which shold be s symlink to a gvfs share)
 * DATE_REGEX (regular expression for dates in ISO format)
+* CHUNK_RECORDS (default number of records processed at once)
+* FEATURE_DTYPE (structured numpy dtype of the pulse features)
+* PSD_WINDOWS (window functions available for noise spectra)
+* INDEX_DTYPE (structured numpy dtype of the record index)
+* PEAK_DTYPE (structured numpy dtype of the peaks found in records)
+* MONITOR_QUANTILES (quantiles of the amplitude in the monitor)
+* MONITOR_DTYPE (structured numpy dtype of the monitor time series)
+* RECORD_COUNT_PROPS (header properties holding the number of records)
+* CATALOG_FILE (default filename of the catalog of scope runs)
 
 The module contains the classes:
 
 * class ScopeData
+* class ScopeDataSet (ScopeData)
+* class SharedScopeData (ScopeData)
+* class ScopeCatalog
+* class PersistenceHistogram
+* class HistogramPyramid
+* class WaveformFilter
+* class MovingAverageFilter (WaveformFilter)
+* class FIRFilter (WaveformFilter)
+* class CRRCFilter (WaveformFilter)
+
+The module contains the functions:
+
+* function read_scope_header
+* function scope_datatype
+* function scope_sampletype
+* function group_scope_runs
+* function load_monitor
+* function parallel_persistence_histogram
+* function landau_pdf
+* function landau_gauss
+* function fit_landau_gauss
+* function fit_charge_spectra
 
 """
 
+from file_utils import *
 from pyhaha import *
 
 MYHOME = os.getenv('HOME')
 M_DATA_DIR  = MYHOME + '/m_data/'            # should be a symlink
 RD_DATA_DIR = MYHOME + '/scratch_nmsamba/'   # should be a symlink
 DATE_REGEX = '_[12][09][0-9][0-9]-[01][0-9]-[0-3][0-9]'
+CHUNK_RECORDS = 1000                         # records per chunk
+FEATURE_DTYPE = np.dtype([('baseline', np.float32),   # V
+                          ('amplitude', np.float32),  # V
+                          ('peak_time', np.float32),  # s
+                          ('rise_time', np.float32),  # s, 10% - 90%
+                          ('tot', np.float32),        # s, time over threshold
+                          ('charge', np.float32)])    # V*s, integrated signal
+PSD_WINDOWS = {'hann': np.hanning, 'hamming': np.hamming,
+               'blackman': np.blackman, 'bartlett': np.bartlett,
+               'boxcar': np.ones}
+INDEX_DTYPE = np.dtype([('min', np.float32),            # V
+                        ('max', np.float32),            # V
+                        ('baseline', np.float32),       # V
+                        ('baseline_rms', np.float32)])  # V
+PEAK_DTYPE = np.dtype([('record', np.int64),     # record number
+                       ('time', np.float32),      # s
+                       ('height', np.float32),    # V above the baseline
+                       ('width', np.float32)])    # s, time over threshold
+MONITOR_QUANTILES = (0.1, 0.5, 0.9)           # of the pulse amplitude
+MONITOR_DTYPE = np.dtype([('record', np.int64),         # first record
+                          ('baseline', np.float32),     # V, mean
+                          ('baseline_std', np.float32), # V, spread
+                          ('noise', np.float32),        # V, mean RMS
+                          ('amplitude', np.float32, (len(MONITOR_QUANTILES),)),
+                          ('occupancy', np.float32)])   # fraction of records
+RECORD_COUNT_PROPS = ['NumberOfAcquisitions']
+CATALOG_FILE = 'scope_catalog.sqlite'
+_LANDAU_MODE = -0.22278                       # most probable value
+_LANDAU_TABLE = None                          # see _landau_table()
 
 class ScopeData:
     """
@@ -65,11 +126,14 @@ class ScopeData:
         self._basename = filename
         self._headerfilename = directory + '/' + filename + '.bin'
         self._datafilename = directory + '/' + filename + '.Wfm.bin'
+        self._indexfilename = directory + '/' + filename + '.idx.npz'
         self._props = collections.OrderedDict()
         self._rawdata = None
         self._data = None
         self._datatype = None
         self._screen = None
+        self._index = None
+        self._shared = []
 
         if not os.path.isfile(self._headerfilename):
             msg = '??? ScopeData ERROR: Class ScopeData ' +\
@@ -89,41 +153,10 @@ class ScopeData:
             return None
 
         # Parse properties
-        doc = et.parse(self._headerfilename)
-        propsextract = doc.xpath('//Group/Prop')
-        props = [i.attrib for i in propsextract]
-        self._props['Resolution'] = float(self.getpropval(props,'Resolution'))
-        rl = int(self.getpropval(props,'RecordLength'))
-        self._props['RecordLength'] = rl
-        self._props['XStart'] = float(self.getpropval(props,'XStart'))
-        self._props['XStop'] = float(self.getpropval(props,'XStop'))
-        self._props['HardwareXStart'] = float(self.getpropval(props,'HardwareXStart'))
-        self._props['HardwareXStop'] = float(self.getpropval(props,'HardwareXStop'))
-        shl = int(self.getpropval(props,'SignalHardwareRecordLength'))
-        self._props['SignalHardwareRecordLength'] = shl
-        lss = int(self.getpropval(props,'LeadingSettlingSamples'))
-        self._props['LeadingSettlingSamples'] = lss
-        vpos = float(self.getpropval(props,'VerticalPosition'))
-        self._props['VerticalPosition'] = vpos
-        vscal = float(self.getpropval(props,'VerticalScale'))
-        self._props['VerticalScale'] = vscal
-        voff = float(self.getpropval(props,'VerticalOffset'))
-        self._props['VerticalOffset'] = voff
-        noql = int(self.getpropval(props,'NofQuantisationLevels'))
-        self._props['NofQuantisationLevels'] = noql
-        vdc = int(self.getpropval(props,'VerticalDivisionCount'))
-        self._props['VerticalDivisionCount'] = vdc
-        tss = shl - rl - lss
-        self._props['TrailingSettlingSaples'] = tss
-        cof = vscal * vdc / noql
-        self._props['ConversionFactor'] = cof
-        coo = voff - vpos * vscal
-        self._props['ConversionOffset'] = coo
+        self._props = read_scope_header(self._headerfilename)
 
         # Load data
-        self._datatype = dtype=([('pre', np.int8, lss),
-                     ('sig', np.int8, rl),
-                     ('aff', np.int8, tss)])
+        self._datatype = scope_datatype(self._props)
         return None
         # End of the constructor
 
@@ -197,15 +230,26 @@ class ScopeData:
                 self._datafilename, count=-1, dtype=self._datatype)
         return self._rawdata
 
-    def get_data(self):
+    def get_data(self, indices=None):
         """
         Parse the data-file and return data. The data-file will only be
         parsed once, if self._data already contains data, these will be
         returned.
 
+        *indices* : list or numpy array of integers, optional
+            If given, only the records with these indices are read and
+            converted (they are not stored in self._data).
+
         *return* : array of numpy-arrays
             data ready for creating plots
         """
+        if indices is not None and self._data is None:
+            props = self.get_props()
+            raw = self.read_records(indices)
+            return raw['sig'] * props['ConversionFactor'] + \
+                props['ConversionOffset']
+        if indices is not None:
+            return self._data[indices]
         if self._rawdata is None:
             self.get_rawdata()
         if self._data is None:
@@ -214,3 +258,2905 @@ class ScopeData:
                 props['ConversionFactor']  + props['ConversionOffset']
         return self._data
 
+    def get_record_count(self):
+        """
+        Returns the number of complete records in the data-file. The number
+        is calculated from the file size, the data-file is not read.
+
+        *return* : integer
+            Number of records (waveforms) in the data-file.
+        """
+        if self._rawdata is not None:
+            return len(self._rawdata)
+        return self._get_file_record_count()
+
+    def _get_file_record_count(self):
+        # Number of complete records in the data-file from its current
+        # size, also if the raw data are cached (e.g. for a growing file)
+        return os.path.getsize(self._datafilename) // self._datatype.itemsize
+
+    def iter_rawdata(self, chunk_size=CHUNK_RECORDS, start=0, stop=None, \
+                     indices=None):
+        """
+        Iterates over the raw data in chunks of *chunk_size* records. Only
+        one chunk is held in memory at a time, hence also data-files larger
+        than the available RAM can be processed. If the raw data have
+        already been loaded with get_rawdata(), the chunks are taken from
+        there. Example::
+
+            for first, chunk in sd.iter_rawdata(5000):
+                print(first, chunk['sig'].max())
+
+        *chunk_size* : integer, optional
+            Number of records per chunk, defaults to CHUNK_RECORDS.
+
+        *start* : integer, optional
+            Index of the first record, defaults to 0.
+
+        *stop* : integer, optional
+            Index after the last record, defaults to the number of records.
+
+        *indices* : list or numpy array of integers, optional
+            If given, only these records are read (e.g. the result of
+            select_records()) and *start* and *stop* are ignored.
+
+        *return* : generator of (integer, numpy-array)
+            Index of the first record in the chunk (or its position within
+            *indices*) and the raw data of the chunk (same format as
+            get_rawdata()).
+        """
+        if indices is not None:
+            indices = np.asarray(indices, dtype=np.int64)
+            for first in range(0, len(indices), chunk_size):
+                yield first, \
+                    self.read_records(indices[first : first + chunk_size])
+            return
+        count = self.get_record_count()
+        if stop is None or stop > count:
+            stop = count
+        if self._rawdata is not None:
+            for first in range(start, stop, chunk_size):
+                yield first, self._rawdata[first : min(first + chunk_size, stop)]
+            return
+        for item in self._iter_file(chunk_size, start, stop):
+            yield item
+
+    def _iter_file(self, chunk_size=CHUNK_RECORDS, start=0, stop=None):
+        # Like iter_rawdata(), but the chunks are always read from the
+        # data-file, cached raw data are not used
+        count = self._get_file_record_count()
+        if stop is None or stop > count:
+            stop = count
+        with open(self._datafilename, 'rb') as fi:
+            fi.seek(start * self._datatype.itemsize)
+            for first in range(start, stop, chunk_size):
+                n = min(chunk_size, stop - first)
+                yield first, np.fromfile(fi, dtype=self._datatype, count=n)
+
+    def read_records(self, indices, max_gap=16):
+        """
+        Reads only the records with the given indices from the data-file.
+        The records have a fixed size, hence each record is located by its
+        byte offset. The indices are sorted, and neighbouring records
+        (with less than *max_gap* records in between) are read with
+        a single read operation. Reading a single record therefore takes
+        only milliseconds, independent of the size of the data-file.
+        If the raw data have already been loaded with get_rawdata(), the
+        records are taken from there. Example::
+
+            raw = sd.read_records([50, 51, 1000])
+            volts = raw['sig'] * sd.get_props()['ConversionFactor'] + \\
+                    sd.get_props()['ConversionOffset']
+
+        *indices* : integer or list or numpy array of integers
+            Indices of the records, in any order, duplicates are allowed.
+            Negative indices count from the end of the data-file.
+
+        *max_gap* : integer, optional
+            Gaps of up to *max_gap* records between requested records
+            are read over instead of seeking, defaults to 16.
+
+        *return* : numpy-array
+            Raw data of the records in the order of *indices* (same format
+            as get_rawdata()).
+        """
+        indices = np.atleast_1d(np.asarray(indices, dtype=np.int64))
+        count = self.get_record_count()
+        indices = np.where(indices < 0, indices + count, indices)
+        if len(indices) > 0 and (indices.min() < 0 or indices.max() >= count):
+            msg = '??? ScopeData ERROR: record index out of range ' +\
+                  '(file has {} records)'.format(count)
+            raise IndexError(msg)
+        if self._rawdata is not None:
+            return self._rawdata[indices]
+        if len(indices) == 0:
+            return np.empty(0, dtype=self._datatype)
+        unique, inverse = np.unique(indices, return_inverse=True)
+        records = np.empty(len(unique), dtype=self._datatype)
+        # coalesce neighbouring records into runs [first, last]
+        breaks = np.flatnonzero(np.diff(unique) > max_gap + 1) + 1
+        run_starts = np.concatenate(([0], breaks))
+        run_stops = np.concatenate((breaks, [len(unique)]))
+        size = self._datatype.itemsize
+        with open(self._datafilename, 'rb') as fi:
+            for i0, i1 in zip(run_starts, run_stops):
+                first = unique[i0]
+                fi.seek(int(first) * size)
+                block = np.fromfile(fi, dtype=self._datatype, \
+                                    count=int(unique[i1 - 1] - first) + 1)
+                records[i0 : i1] = block[unique[i0 : i1] - first]
+        return records[inverse.ravel()]
+
+    def _get_datafilenames(self):
+        # All data-files read by this object
+        return [self._datafilename]
+
+    def _read_raw_into(self, out):
+        # Reads the first len(out) records of the data-file directly into
+        # the (contiguous) array out, without an intermediate copy.
+        with open(self._datafilename, 'rb') as fi:
+            fi.readinto(out.view(np.uint8))
+        return out
+
+    def _selection(self, start, stop, indices):
+        # Normalized (start, stop) of a selection, for *indices* the
+        # positions within *indices* are used.
+        if indices is not None:
+            return 0, len(indices)
+        count = self.get_record_count()
+        if stop is None or stop > count:
+            stop = count
+        return start, max(stop, start)
+
+    def get_persistence_histogram(self, chunk_size=CHUNK_RECORDS, \
+                                  start=0, stop=None, indices=None, \
+                                  code_bin=1, sparse=None, filt=None):
+        """
+        Accumulates the persistence histogram (as used by SpectrumPlot)
+        chunk by chunk, without loading the whole data-file.
+
+        *chunk_size* : integer, optional
+            Number of records per chunk, defaults to CHUNK_RECORDS.
+
+        *start*, *stop* : integer, optional
+            Record range to be histogrammed, defaults to all records.
+            Several ranges can be histogrammed independently (e.g. in
+            worker processes) and combined with PersistenceHistogram.merge().
+
+        *indices* : list or numpy array of integers, optional
+            If given, only these records are histogrammed.
+
+        *code_bin* : integer, optional
+            Number of adjacent ADC levels combined into one bin,
+            defaults to 1.
+
+        *sparse* : bool, optional
+            If True, only occupied cells are stored. If None (default),
+            a sparse histogram is used for samples with more than 8 bit.
+
+        *filt* : WaveformFilter, optional
+            If given, the records are filtered with *filt* and the
+            filtered values (rounded to ADC levels) are histogrammed.
+
+        *return* : PersistenceHistogram
+            The histogram of the selected records.
+        """
+        hist = self.new_persistence_histogram(code_bin, sparse)
+        if filt is None:
+            for first, chunk in self.iter_rawdata(chunk_size, start, stop, \
+                                                  indices):
+                hist.fill(chunk['sig'])
+            return hist
+        info = np.iinfo(self._datatype['sig'].base)
+        for first, s, base in self._iter_signal(chunk_size, start, stop, \
+                                                1, indices, filt):
+            s += base[:, np.newaxis]
+            hist.fill(np.clip(np.rint(s), info.min, info.max))
+        return hist
+
+    def new_persistence_histogram(self, code_bin=1, sparse=None):
+        """
+        Creates an empty persistence histogram matching the record length
+        and the sample type of this data-file.
+
+        *code_bin* : integer, optional
+            Number of adjacent ADC levels combined into one bin,
+            defaults to 1.
+
+        *sparse* : bool, optional
+            If True, only occupied cells are stored. If None (default),
+            a sparse histogram is used for samples with more than 8 bit.
+
+        *return* : PersistenceHistogram
+            The empty histogram.
+        """
+        info = np.iinfo(self._datatype['sig'].base)
+        if sparse is None:
+            sparse = info.bits > 8
+        return PersistenceHistogram(self._props['RecordLength'], \
+            int(info.max) - int(info.min) + 1, -int(info.min), \
+            code_bin, sparse)
+
+    def _pyramid_directory(self):
+        # Default directory of the pyramid, next to the data-file
+        return self._headerfilename[:-len('.bin')] + '.pyramid'
+
+    def build_pyramid(self, directory=None, factor=2, \
+                      chunk_size=CHUNK_RECORDS, code_bin=1, sparse=None):
+        """
+        Builds a multi-resolution pyramid of persistence histograms (see
+        class HistogramPyramid) in one streaming pass over the data-file.
+
+        *directory* : string, optional
+            Directory for the pyramid, defaults to ``xxx_raw.pyramid``
+            next to the data-file.
+
+        *factor* : integer, optional
+            Number of samples combined from one level to the next,
+            defaults to 2. Must be at least 2, otherwise a ValueError
+            is raised before the data-file is read.
+
+        *chunk_size*, *code_bin*, *sparse* : optional
+            See get_persistence_histogram().
+
+        *return* : HistogramPyramid
+            The new pyramid.
+        """
+        factor = HistogramPyramid._check_factor(factor)
+        if directory is None:
+            directory = self._pyramid_directory()
+        hist = self.get_persistence_histogram(chunk_size, code_bin=code_bin, \
+                                              sparse=sparse)
+        return HistogramPyramid.build(hist, directory, factor, \
+                                      self._get_datafilenames())
+
+    def get_pyramid(self, directory=None, factor=2, \
+                    chunk_size=CHUNK_RECORDS, code_bin=1, sparse=None):
+        """
+        Returns the multi-resolution pyramid of persistence histograms.
+        It is opened from *directory* if it is still valid (same
+        data-files with the same size and modification time, same
+        *factor* and *code_bin*), otherwise it is built (see
+        build_pyramid()).
+
+        *directory*, *factor*, *chunk_size*, *code_bin*, *sparse* : optional
+            See build_pyramid().
+
+        *return* : HistogramPyramid
+            The pyramid.
+        """
+        if directory is None:
+            directory = self._pyramid_directory()
+        if os.path.isfile(os.path.join(directory, 'pyramid.npz')):
+            pyramid = HistogramPyramid(directory)
+            if pyramid.get_factor() == factor and \
+               pyramid.get_code_bin() == code_bin and \
+               pyramid.is_current(self._get_datafilenames()):
+                return pyramid
+        return self.build_pyramid(directory, factor, chunk_size, \
+                                  code_bin, sparse)
+
+    def get_time_axis(self):
+        """
+        *return* : numpy array of float
+            The time of each sample of a record in s, calculated from the
+            properties 'XStart', 'XStop' and 'RecordLength'.
+        """
+        return np.linspace(self._props['XStart'], self._props['XStop'], \
+                           self._props['RecordLength'])
+
+    def _sample_interval(self):
+        # Time between two samples in s, consistent with get_time_axis()
+        rl = self._props['RecordLength']
+        return (self._props['XStop'] - self._props['XStart']) / max(rl - 1, 1)
+
+    def _baseline(self, chunk):
+        # Baseline in ADC units for each record of a chunk, taken from the
+        # leading settling samples or - if there are none - from the
+        # first 10% of the signal samples.
+        if self._props['LeadingSettlingSamples'] > 0:
+            return chunk['pre'].mean(axis=1, dtype=np.float32)
+        n = max(1, self._props['RecordLength'] // 10)
+        return chunk['sig'][:, :n].mean(axis=1, dtype=np.float32)
+
+    def _iter_signal(self, chunk_size=CHUNK_RECORDS, start=0, stop=None, \
+                     polarity=1, indices=None, filt=None):
+        # Yields (first, s, baseline) for each chunk, where s is the
+        # baseline subtracted (and optionally filtered) signal in ADC units
+        # as float32, multiplied by polarity so that pulses are always
+        # positive.
+        dt = self._sample_interval()
+        for first, chunk in self.iter_rawdata(chunk_size, start, stop, \
+                                              indices):
+            base = self._baseline(chunk)
+            s = chunk['sig'].astype(np.float32)
+            s -= base[:, np.newaxis]
+            if filt is not None:
+                s = filt.apply(s, dt)
+            if polarity < 0:
+                np.negative(s, out=s)
+            yield first, s, base
+
+    def get_features(self, threshold=None, polarity=1, \
+                     chunk_size=CHUNK_RECORDS, start=0, stop=None, \
+                     indices=None, filt=None):
+        """
+        Extracts pulse features for all records at once. The records are
+        processed chunk by chunk with array operations, therefore also
+        data-files larger than the available RAM can be analysed.
+        For each record the following features are calculated:
+
+        * baseline: mean of the leading settling samples in V
+        * amplitude: maximum of the baseline subtracted signal in V
+        * peak_time: time of the maximum in s
+        * rise_time: time between 10% and 90% of the amplitude on the
+          leading edge in s (linear interpolation between samples)
+        * tot: time over threshold in s
+        * charge: integral of the baseline subtracted signal in V*s
+          (divide by the input impedance to obtain a charge)
+
+        *threshold* : float, optional
+            Threshold in V above the baseline for the time over threshold.
+            If None, half of the amplitude of each record is used.
+
+        *polarity* : integer, optional
+            +1 for positive pulses (default), -1 for negative pulses.
+
+        *chunk_size* : integer, optional
+            Number of records per chunk, defaults to CHUNK_RECORDS.
+
+        *start*, *stop* : integer, optional
+            Record range to be analysed, defaults to all records.
+
+        *indices* : list or numpy array of integers, optional
+            If given, only these records are analysed (e.g. the result of
+            select_records()), *start* and *stop* are ignored.
+
+        *filt* : WaveformFilter, optional
+            If given, each record is filtered with *filt* (e.g. a
+            CRRCFilter) before it is analysed. The filtered records
+            are not stored.
+
+        *return* : numpy array of FEATURE_DTYPE
+            One line for each record, fields can be accessed by name,
+            e.g. ``sd.get_features()['amplitude']``. Features which cannot
+            be determined (e.g. the rise time of an empty record) are NaN.
+        """
+        props = self._props
+        cof = props['ConversionFactor']
+        coo = props['ConversionOffset']
+        rl = props['RecordLength']
+        dt = (props['XStop'] - props['XStart']) / max(rl - 1, 1)
+        start, stop = self._selection(start, stop, indices)
+        features = np.zeros(stop - start, dtype=FEATURE_DTYPE)
+        rows = np.arange(chunk_size)
+        for first, s, base in self._iter_signal(chunk_size, start, stop, \
+                                                polarity, indices, filt):
+            n = len(s)
+            out = features[first - start : first - start + n]
+            i_peak = s.argmax(axis=1)
+            amp = s[rows[:n], i_peak]
+            t10 = _last_crossing(s, 0.1 * amp, i_peak)
+            t90 = _last_crossing(s, 0.9 * amp, i_peak)
+            if threshold is None:
+                level = 0.5 * amp[:, np.newaxis]
+            else:
+                level = threshold / cof
+            out['baseline'] = base * cof + coo
+            out['amplitude'] = amp * cof
+            out['peak_time'] = props['XStart'] + i_peak * dt
+            out['rise_time'] = (t90 - t10) * dt
+            out['tot'] = np.count_nonzero(s > level, axis=1) * dt
+            out['charge'] = s.sum(axis=1) * (cof * dt)
+        return features
+
+    def find_peaks(self, threshold, min_distance=1, polarity=1, \
+                   chunk_size=CHUNK_RECORDS, start=0, stop=None, \
+                   indices=None, filt=None):
+        """
+        Finds all local maxima above *threshold* in each record (e.g. for
+        pile-up and afterpulse studies), not only the global maximum.
+        The records are processed chunk by chunk with array operations.
+        As the number of peaks differs from record to record, the result
+        is ragged: one flat array with all peaks and an array of offsets,
+        the peaks of the i-th selected record are
+        ``peaks[offsets[i] : offsets[i + 1]]``. Example::
+
+            peaks, offsets = sd.find_peaks(0.02)
+            npeaks = np.diff(offsets)             # peaks per record
+            dt = np.diff(peaks['time'])[np.diff(peaks['record']) == 0]
+
+        A sample is a peak if it is above *threshold*, is the maximum
+        of the *min_distance* samples on both sides and is larger than
+        the following sample (for flat tops the last sample is taken).
+        The width of a peak is the time over threshold of the part of the
+        record above threshold which contains the peak.
+
+        *threshold* : float
+            Threshold in V above the baseline.
+
+        *min_distance* : integer, optional
+            Minimum distance in samples between two peaks, defaults to 1.
+
+        *polarity* : integer, optional
+            +1 for positive pulses (default), -1 for negative pulses.
+
+        *chunk_size* : integer, optional
+            Number of records per chunk, defaults to CHUNK_RECORDS.
+
+        *start*, *stop*, *indices* : optional
+            Selection of the records, see get_features().
+
+        *filt* : WaveformFilter, optional
+            If given, each record is filtered with *filt* before the
+            peaks are searched.
+
+        *return* : two numpy arrays
+            The peaks as numpy array of PEAK_DTYPE, ordered by record and
+            time, and the offsets (int64, one more than selected records).
+        """
+        props = self._props
+        cof = props['ConversionFactor']
+        rl = props['RecordLength']
+        dt = self._sample_interval()
+        level = threshold / cof
+        start, stop = self._selection(start, stop, indices)
+        counts = np.zeros(stop - start, dtype=np.int64)
+        peaks = []
+        for first, s, base in self._iter_signal(chunk_size, start, stop, \
+                                                polarity, indices, filt):
+            n = len(s)
+            above = s > level
+            # maximum of the neighbours within min_distance
+            left = np.full_like(s, -np.inf)
+            right = np.full_like(s, -np.inf)
+            for d in range(1, max(min_distance, 1) + 1):
+                np.maximum(left[:, d:], s[:, :-d], out=left[:, d:])
+                np.maximum(right[:, :-d], s[:, d:], out=right[:, :-d])
+            rows, cols = np.nonzero(above & (s >= left) & (s > right))
+            # runs above threshold, numbered along the flattened chunk
+            # (the extra column separates the records)
+            flat = np.zeros((n, rl + 1), dtype=bool)
+            flat[:, :rl] = above
+            flat = flat.ravel()
+            rising = np.empty_like(flat)
+            rising[0] = flat[0]
+            rising[1:] = flat[1:] & ~flat[:-1]
+            run = np.cumsum(rising)
+            run_length = np.bincount(run[flat])
+            out = np.zeros(len(rows), dtype=PEAK_DTYPE)
+            if indices is None:
+                out['record'] = first + rows
+            else:
+                out['record'] = np.asarray(indices)[first + rows]
+            out['time'] = props['XStart'] + cols * dt
+            out['height'] = s[rows, cols] * cof
+            out['width'] = run_length[run[rows * (rl + 1) + cols]] * dt
+            peaks.append(out)
+            counts[first - start : first - start + n] = \
+                np.bincount(rows, minlength=n)
+        offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        if peaks:
+            return np.concatenate(peaks), offsets
+        return np.zeros(0, dtype=PEAK_DTYPE), offsets
+
+    def get_charge_histogram(self, bins=100, range=None, window=None, \
+                             polarity=1, chunk_size=CHUNK_RECORDS, start=0, \
+                             stop=None, indices=None, filt=None):
+        """
+        Histograms the integrated charge of the records (the integral of
+        the baseline subtracted signal in V*s, as feature 'charge' of
+        get_features()). The records are processed chunk by chunk; if
+        *range* is given, only the histogram is kept in memory. The result
+        can be fitted with fit_landau_gauss()::
+
+            counts, edges = sd.get_charge_histogram(200, window=(0, 50e-9))
+            params, errors, chi2_ndf = fit_landau_gauss(counts, edges)
+
+        *bins* : integer, optional
+            Number of bins, defaults to 100.
+
+        *range* : (float, float), optional
+            Lower and upper edge of the histogram in V*s. If None, the
+            range of the charges is used.
+
+        *window* : (float, float), optional
+            Integration window (first and last time in s). If None, the
+            whole record is integrated.
+
+        *polarity* : integer, optional
+            +1 for positive pulses (default), -1 for negative pulses.
+
+        *chunk_size*, *start*, *stop*, *indices*, *filt* : optional
+            See get_features().
+
+        *return* : two numpy arrays
+            The counts (int64) and the *bins* + 1 bin edges in V*s.
+        """
+        dt = self._sample_interval()
+        scale = self._props['ConversionFactor'] * dt
+        i_min, i_max = 0, self._props['RecordLength']
+        if window is not None:
+            taxis = self.get_time_axis()
+            i_min, i_max = np.searchsorted(taxis, window[0]), \
+                           np.searchsorted(taxis, window[1], side='right')
+        charges = []
+        counts = np.zeros(bins, dtype=np.int64)
+        for first, s, base in self._iter_signal(chunk_size, start, stop, \
+                                                polarity, indices, filt):
+            q = s[:, i_min:i_max].sum(axis=1) * scale
+            if range is None:
+                charges.append(q)
+            else:
+                counts += np.histogram(q, bins, range)[0]
+        if range is None:
+            q = np.concatenate(charges) if charges else np.zeros(0)
+            return np.histogram(q, bins)
+        return counts, np.linspace(range[0], range[1], bins + 1)
+
+
+    def get_cfd_times(self, fraction=0.3, delay=None, interpolation='linear', \
+                      polarity=1, chunk_size=CHUNK_RECORDS, start=0, stop=None, \
+                      indices=None, filt=None):
+        """
+        Calculates constant-fraction discriminator (CFD) times for all
+        records at once, without a loop over the records. Two variants
+        are available:
+
+        * *delay* is None: digital CFD, the time is where the leading edge
+          crosses *fraction* times the amplitude of the record.
+        * *delay* is given: classical CFD, the time is the zero crossing of
+          :math:`s(t - delay) - fraction \\cdot s(t)` before its maximum.
+
+        The crossing between two samples is interpolated linear or with a
+        parabola through three samples. The times are based on the time
+        axis given by 'XStart', 'XStop' and 'RecordLength'.
+
+        *fraction* : float, optional
+            Fraction of the amplitude, defaults to 0.3.
+
+        *delay* : float, optional
+            Delay in s for the classical CFD, rounded to whole samples.
+            Defaults to None (digital CFD).
+
+        *interpolation* : string, optional
+            Either 'linear' (default) or 'parabolic'.
+
+        *polarity* : integer, optional
+            +1 for positive pulses (default), -1 for negative pulses.
+
+        *chunk_size* : integer, optional
+            Number of records per chunk, defaults to CHUNK_RECORDS.
+
+        *start*, *stop* : integer, optional
+            Record range to be analysed, defaults to all records.
+
+        *indices* : list or numpy array of integers, optional
+            If given, only these records are analysed, *start* and *stop*
+            are ignored.
+
+        *filt* : WaveformFilter, optional
+            If given, each record is filtered with *filt* (e.g. a
+            CRRCFilter) before it is analysed. The filtered records
+            are not stored.
+
+        *return* : numpy array of float32
+            One CFD time in s for each record, NaN if no crossing is found.
+            Can directly be passed to ``np.histogram(...)``.
+        """
+        props = self._props
+        rl = props['RecordLength']
+        dt = (props['XStop'] - props['XStart']) / max(rl - 1, 1)
+        start, stop = self._selection(start, stop, indices)
+        times = np.zeros(stop - start, dtype=np.float32)
+        if delay is not None:
+            d = max(int(round(delay / dt)), 1)
+        for first, s, base in self._iter_signal(chunk_size, start, stop, \
+                                                polarity, indices, filt):
+            if delay is None:
+                i_peak = s.argmax(axis=1)
+                level = fraction * s[np.arange(len(s)), i_peak]
+                t = _last_crossing(s, level, i_peak, interpolation)
+            else:
+                y = -fraction * s
+                y[:, d:] += s[:, :-d]
+                t = _last_crossing(y, np.zeros(len(y)), y.argmax(axis=1), \
+                                   interpolation)
+            times[first - start : first - start + len(s)] = \
+                props['XStart'] + t * dt
+        return times
+
+
+    def get_average(self, align=None, template=None, fraction=0.3, \
+                    max_shift=None, polarity=1, chunk_size=CHUNK_RECORDS, \
+                    start=0, stop=None, indices=None, filt=None):
+        """
+        Averages many records to extract small signals from noise. To
+        avoid smearing by trigger jitter each record can be aligned first:
+        a time shift is estimated for each record and the record is
+        shifted by this (fractional) number of samples with linear
+        interpolation. Mean and variance are accumulated chunk by chunk,
+        hence the memory needed does not depend on the number of records.
+        Samples which are shifted out of a record do not contribute.
+
+        *align* : string, optional
+            None (default): no alignment,
+            'cfd': align the CFD times (digital CFD, see get_cfd_times()),
+            'xcorr': align to the maximum of the cross-correlation
+            with *template*.
+
+        *template* : numpy array of float, optional
+            Template for *align* = 'xcorr' in V, baseline subtracted,
+            with 'RecordLength' samples. If None, the unaligned average
+            of the first chunk is used.
+
+        *fraction* : float, optional
+            Fraction of the amplitude for *align* = 'cfd', defaults to 0.3.
+
+        *max_shift* : integer, optional
+            Records with a shift of more than *max_shift* samples are
+            skipped. Defaults to None (no limit).
+
+        *polarity* : integer, optional
+            +1 for positive pulses (default), -1 for negative pulses.
+
+        *chunk_size* : integer, optional
+            Number of records per chunk, defaults to CHUNK_RECORDS.
+
+        *start*, *stop*, *indices* : optional
+            Selection of the records, see get_features().
+
+        *filt* : WaveformFilter, optional
+            If given, each record is filtered with *filt* (e.g. a
+            CRRCFilter) before it is analysed. The filtered records
+            are not stored.
+
+        *return* : three numpy arrays
+            The mean and the variance of the baseline subtracted signal
+            in V resp. :math:`V^2` for each sample, and the number of
+            records which contributed to each sample.
+        """
+        cof = self._props['ConversionFactor']
+        rl = self._props['RecordLength']
+        idx = np.arange(rl)
+        count = np.zeros(rl)
+        mean = np.zeros(rl)
+        m2 = np.zeros(rl)
+        reference = None
+        if template is not None:
+            template = polarity * np.asarray(template, dtype=np.float64) / cof
+        for first, s, base in self._iter_signal(chunk_size, start, stop, \
+                                                polarity, indices, filt):
+            if align is None:
+                shift = np.zeros(len(s))
+            elif align == 'cfd':
+                i_peak = s.argmax(axis=1)
+                t = _last_crossing(s, fraction * s[np.arange(len(s)), i_peak], \
+                                   i_peak)
+                if reference is None:
+                    reference = np.nanmedian(t)
+                shift = t - reference
+            elif align == 'xcorr':
+                if template is None:
+                    template = s.mean(axis=0, dtype=np.float64)
+                shift = _xcorr_shift(s, template)
+            else:
+                msg = '??? ScopeData ERROR: unknown alignment "{}"'
+                raise ValueError(msg.format(align))
+            ok = np.isfinite(shift)
+            if max_shift is not None:
+                ok &= np.abs(np.where(ok, shift, 0.0)) <= max_shift
+            s = s[ok]
+            shift = shift[ok]
+            if len(s) == 0:
+                continue
+            # aligned[i, j] = s[i, j + shift[i]], linear interpolation
+            pos = idx[np.newaxis, :] + shift[:, np.newaxis]
+            valid = (pos >= 0) & (pos <= rl - 1)
+            i0 = np.clip(np.floor(pos).astype(np.intp), 0, max(rl - 2, 0))
+            frac = np.clip(pos - i0, 0.0, 1.0)
+            rows = np.arange(len(s))[:, np.newaxis]
+            aligned = s[rows, i0] * (1.0 - frac) + \
+                      s[rows, np.minimum(i0 + 1, rl - 1)] * frac
+            # merge mean and variance of this chunk (Chan et al.)
+            n_c = valid.sum(axis=0)
+            sum_c = np.where(valid, aligned, 0.0).sum(axis=0)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                mean_c = np.where(n_c > 0, sum_c / n_c, 0.0)
+                m2_c = np.where(valid, (aligned - mean_c)**2, 0.0).sum(axis=0)
+                total = count + n_c
+                delta = mean_c - mean
+                mean = np.where(total > 0, mean + delta * n_c / total, 0.0)
+                m2 = np.where(total > 0, \
+                              m2 + m2_c + delta**2 * count * n_c / total, 0.0)
+            count = total
+        with np.errstate(divide='ignore', invalid='ignore'):
+            variance = np.where(count > 1, m2 / (count - 1), np.nan)
+        return polarity * mean * cof, variance * cof**2, count.astype(np.int64)
+
+    def get_noise_psd(self, window='hann', chunk_size=CHUNK_RECORDS, \
+                      start=0, stop=None, indices=None, filt=None):
+        """
+        Estimates the noise power spectral density (PSD) of the readout
+        chain by averaging the FFTs of all records. The records are
+        transformed with batched real FFTs chunk by chunk, so the memory
+        needed is bounded by *chunk_size*. The mean of each record is
+        subtracted before the window function is applied. The frequency
+        axis is based on the property 'Resolution' (sample interval).
+
+        *window* : string, optional
+            Window function, one of the keys of PSD_WINDOWS ('hann',
+            'hamming', 'blackman', 'bartlett', 'boxcar'), defaults to 'hann'.
+
+        *chunk_size* : integer, optional
+            Number of records per chunk, defaults to CHUNK_RECORDS.
+
+        *start*, *stop* : integer, optional
+            Record range to be analysed, defaults to all records.
+
+        *indices* : list or numpy array of integers, optional
+            If given, only these records are analysed, *start* and *stop*
+            are ignored.
+
+        *filt* : WaveformFilter, optional
+            If given, each record is filtered with *filt* (e.g. a
+            CRRCFilter) before it is analysed. The filtered records
+            are not stored.
+
+        *return* : two numpy arrays of float
+            The frequencies in Hz and the averaged one-sided PSD
+            in :math:`V^2/Hz`.
+        """
+        try:
+            win_func = PSD_WINDOWS[window]
+        except KeyError:
+            msg = '??? ScopeData ERROR: unknown window "{}"'.format(window)
+            raise ValueError(msg)
+        rl = self._props['RecordLength']
+        res = self._props['Resolution']
+        win = win_func(rl).astype(np.float32)
+        freqs = np.fft.rfftfreq(rl, d=res)
+        power = np.zeros(len(freqs))
+        records = 0
+        for first, sig, base in self._iter_signal(chunk_size, start, stop, \
+                                                  1, indices, filt):
+            sig -= sig.mean(axis=1, keepdims=True)
+            sig *= win
+            spec = np.fft.rfft(sig, axis=1)
+            power += (spec.real**2 + spec.imag**2).sum(axis=0)
+            records += len(sig)
+        # one-sided PSD, DC and Nyquist frequency are not doubled
+        scale = self._props['ConversionFactor']**2 * res / \
+                (max(records, 1) * np.sum(win.astype(np.float64)**2))
+        psd = power * scale
+        psd[1 : (rl + 1) // 2] *= 2.0
+        return freqs, psd
+
+    def classify_records(self, templates, min_score=None, polarity=1, \
+                         chunk_size=CHUNK_RECORDS, start=0, stop=None, \
+                         indices=None, filt=None):
+        """
+        Sorts the records into classes (e.g. signal, double pulse, pickup,
+        saturated) by comparing them with a bank of templates. Records and
+        templates are normalized (mean 0, norm 1), so that the score is the
+        correlation coefficient, independent of amplitude and baseline.
+        A whole chunk is compared with all templates by one matrix product.
+
+        *templates* : numpy array of float
+            One template per line with 'RecordLength' samples, e.g. the
+            result of get_average() or the centroids of cluster_records().
+            Templates are compared with the records multiplied by
+            *polarity*, i.e. pulses should be positive.
+
+        *min_score* : float, optional
+            If given, records whose best score is below *min_score* get
+            the label -1 (no matching template).
+
+        *polarity* : integer, optional
+            +1 for positive pulses (default), -1 for negative pulses.
+
+        *chunk_size* : integer, optional
+            Number of records per chunk, defaults to CHUNK_RECORDS.
+
+        *start*, *stop*, *indices* : optional
+            Selection of the records, see get_features().
+
+        *filt* : WaveformFilter, optional
+            If given, each record is filtered with *filt* before it is
+            compared.
+
+        *return* : two numpy arrays
+            The label (index of the best template) as int32 and the
+            corresponding score as float32, one value per record.
+        """
+        tmpl = _normalize_records(np.atleast_2d(templates))
+        if tmpl.shape[1] != self._props['RecordLength']:
+            msg = '??? ScopeData ERROR: templates must have {} samples'
+            raise ValueError(msg.format(self._props['RecordLength']))
+        start, stop = self._selection(start, stop, indices)
+        labels = np.zeros(stop - start, dtype=np.int32)
+        scores = np.zeros(stop - start, dtype=np.float32)
+        for first, s, base in self._iter_signal(chunk_size, start, stop, \
+                                                polarity, indices, filt):
+            n = len(s)
+            corr = _normalize_records(s) @ tmpl.T
+            best = corr.argmax(axis=1)
+            labels[first - start : first - start + n] = best
+            scores[first - start : first - start + n] = \
+                corr[np.arange(n), best]
+        if min_score is not None:
+            labels[scores < min_score] = -1
+        return labels, scores
+
+    def cluster_records(self, n_clusters, iterations=20, seed=None, \
+                        polarity=1, chunk_size=CHUNK_RECORDS, start=0, \
+                        stop=None, indices=None, filt=None):
+        """
+        Groups the records into *n_clusters* classes of similar shape with
+        the k-means algorithm, without templates. The records are
+        normalized as in classify_records(). The start centroids are
+        chosen (k-means++) from the first chunk, then each iteration is
+        one pass over the data-file, which assigns every record to the
+        nearest centroid and recalculates the centroids. The iteration
+        stops early if no record changes its class.
+
+        *n_clusters* : integer
+            Number of classes.
+
+        *iterations* : integer, optional
+            Maximum number of passes over the data-file, defaults to 20.
+
+        *seed* : integer, optional
+            Seed of the random generator for the start centroids.
+
+        *polarity*, *chunk_size*, *start*, *stop*, *indices*, *filt* :
+            See classify_records().
+
+        *return* : two numpy arrays
+            The label of each record as int32 and the centroids (one line
+            per class, normalized shape in ADC units), which can be used
+            as templates for classify_records() on further runs.
+        """
+        start, stop = self._selection(start, stop, indices)
+        nrec = stop - start
+        if nrec < n_clusters:
+            msg = '??? ScopeData ERROR: {} records for {} clusters'
+            raise ValueError(msg.format(nrec, n_clusters))
+        rng = np.random.RandomState(seed)
+        # k-means++ start centroids from the first chunk
+        first, s, base = next(self._iter_signal(max(chunk_size, n_clusters), \
+                              start, stop, polarity, indices, filt))
+        s = _normalize_records(s)
+        # (greedy: of several candidates the one which reduces the sum of
+        # distances most, so isolated noise records are not preferred)
+        centroids = [s[rng.randint(len(s))]]
+        s2 = (s**2).sum(axis=1)
+        dist = ((s - centroids[0])**2).sum(axis=1)
+        trials = 2 + int(np.log(n_clusters))
+        for k in range(1, n_clusters):
+            if dist.sum() > 0:
+                p = dist / dist.sum()
+            else:
+                p = np.full(len(s), 1.0 / len(s))
+            cand = rng.choice(len(s), trials, p=p)
+            d = s2 + s2[cand, np.newaxis] - 2.0 * (s[cand] @ s.T)
+            d = np.minimum(dist, np.maximum(d, 0.0))
+            best = d.sum(axis=1).argmin()
+            dist = d[best]
+            centroids.append(s[cand[best]])
+        centroids = np.array(centroids, dtype=np.float32)
+        labels = np.full(nrec, -1, dtype=np.int32)
+        for it in range(iterations):
+            sums = np.zeros_like(centroids, dtype=np.float64)
+            counts = np.zeros(n_clusters, dtype=np.int64)
+            c2 = (centroids**2).sum(axis=1)
+            changed = 0
+            for first, s, base in self._iter_signal(chunk_size, start, \
+                                        stop, polarity, indices, filt):
+                n = len(s)
+                s = _normalize_records(s)
+                # squared distance without the constant norm of s
+                new = (c2 - 2.0 * (s @ centroids.T)).argmin(axis=1)
+                old = labels[first - start : first - start + n]
+                changed += np.count_nonzero(new != old)
+                old[:] = new
+                sums += np.eye(n_clusters, dtype=np.float32)[new].T @ s
+                counts += np.bincount(new, minlength=n_clusters)
+            used = counts > 0    # empty classes keep their centroid
+            centroids[used] = sums[used] / counts[used, np.newaxis]
+            if changed == 0:
+                break
+        return labels, centroids
+
+
+    def build_index(self, chunk_size=CHUNK_RECORDS, save=True):
+        """
+        Calculates summary statistics for each record in one pass over the
+        data-file: minimum, maximum, baseline (mean of the leading settling
+        samples) and baseline RMS, all in V. The index is cached in the
+        object and - if *save* is True - stored in the sidecar file
+        ``xxx_raw.idx.npz`` next to the data-file, so that it has to be
+        calculated only once per data-file.
+
+        *chunk_size* : integer, optional
+            Number of records per chunk, defaults to CHUNK_RECORDS.
+
+        *save* : bool, optional
+            If True (default), the index is written to the sidecar file.
+            If that is not possible (e.g. a read-only share) a message is
+            printed and the index is only kept in memory.
+
+        *return* : numpy array of INDEX_DTYPE
+            One line for each record.
+        """
+        cof = self._props['ConversionFactor']
+        coo = self._props['ConversionOffset']
+        lss = self._props['LeadingSettlingSamples']
+        index = np.zeros(self.get_record_count(), dtype=INDEX_DTYPE)
+        for first, chunk in self.iter_rawdata(chunk_size):
+            out = index[first : first + len(chunk)]
+            sig = chunk['sig']
+            base = self._baseline(chunk)
+            if lss > 0:
+                pre = chunk['pre'].astype(np.float32) - base[:, np.newaxis]
+            else:
+                n = max(1, self._props['RecordLength'] // 10)
+                pre = sig[:, :n].astype(np.float32) - base[:, np.newaxis]
+            out['min'] = sig.min(axis=1) * cof + coo
+            out['max'] = sig.max(axis=1) * cof + coo
+            out['baseline'] = base * cof + coo
+            out['baseline_rms'] = np.sqrt((pre**2).mean(axis=1)) * abs(cof)
+        self._index = index
+        if save:
+            stat = os.stat(self._datafilename)
+            try:
+                with open(self._indexfilename, 'wb') as fo:
+                    np.savez(fo, index=index, size=stat.st_size, \
+                             mtime=stat.st_mtime)
+            except (IOError, OSError):
+                msg = '*** ScopeData: Index-File "{}" could not be ' +\
+                      'written'
+                print(msg.format(self._indexfilename))
+        return index
+
+    def get_index(self, chunk_size=CHUNK_RECORDS):
+        """
+        Returns the record index (see build_index()). It is taken from
+        memory, or from the sidecar file if this is still valid (same size
+        and modification time of the data-file), otherwise it is built.
+
+        *chunk_size* : integer, optional
+            Number of records per chunk if the index has to be built.
+
+        *return* : numpy array of INDEX_DTYPE
+            One line for each record.
+        """
+        if self._index is not None and \
+           len(self._index) == self.get_record_count():
+            return self._index
+        if os.path.isfile(self._indexfilename):
+            stat = os.stat(self._datafilename)
+            with np.load(self._indexfilename) as npz:
+                if int(npz['size']) == stat.st_size and \
+                   float(npz['mtime']) == stat.st_mtime:
+                    self._index = npz['index']
+                    return self._index
+        return self.build_index(chunk_size)
+
+    def get_monitor(self, window=1000, step=None, threshold=None, \
+                    polarity=1, chunk_size=CHUNK_RECORDS, filename=None):
+        """
+        Calculates a compact time series of the running conditions over
+        the record number: for windows of *window* consecutive records the
+        mean and spread of the baseline, the mean baseline RMS (noise), the
+        quantiles MONITOR_QUANTILES of the pulse amplitude and the
+        occupancy (fraction of records with a pulse above *threshold*).
+        It is calculated from the record index (see get_index()) with
+        cumulative sums, so the waveforms are read at most once per
+        data-file. Example::
+
+            mon = sd.get_monitor(window=500, filename='run1_mon.npz')
+            MonitorPlot(sd).make_plot(load_monitor('run1_mon.npz'))
+
+        *window* : integer, optional
+            Number of records per window, defaults to 1000. If the run has
+            fewer records, one window with all records is used.
+
+        *step* : integer, optional
+            Distance in records between the starts of two windows, defaults
+            to *window* (no overlap). Smaller values give a rolling monitor.
+
+        *threshold* : float, optional
+            Threshold in V above the baseline for the occupancy. If None,
+            five times the median baseline RMS is used.
+
+        *polarity* : integer, optional
+            +1 for positive pulses (default), -1 for negative pulses.
+
+        *chunk_size* : integer, optional
+            Number of records per chunk if the index has to be built.
+
+        *filename* : string, optional
+            If given, the monitor is also saved in this ``.npz``-file,
+            which can be read with load_monitor().
+
+        *return* : numpy array of MONITOR_DTYPE
+            One line for each window.
+        """
+        index = self.get_index(chunk_size)
+        n = len(index)
+        window = max(1, min(window, n))
+        if step is None:
+            step = window
+        if polarity < 0:
+            amp = index['baseline'] - index['min']
+        else:
+            amp = index['max'] - index['baseline']
+        if threshold is None:
+            threshold = 5.0 * np.median(index['baseline_rms']) if n else 0.0
+        firsts = np.arange(0, n - window + 1, step)
+        monitor = np.zeros(len(firsts), dtype=MONITOR_DTYPE)
+        monitor['record'] = firsts
+
+        def window_mean(x):
+            # mean over each window from the cumulative sum
+            cs = np.zeros(n + 1)
+            np.cumsum(x, dtype=np.float64, out=cs[1:])
+            return (cs[firsts + window] - cs[firsts]) / window
+
+        base = index['baseline'].astype(np.float64)
+        mean = window_mean(base)
+        # shifted by the first baseline to avoid cancellation
+        b0 = base[0] if n else 0.0
+        var = window_mean((base - b0)**2) - (mean - b0)**2
+        monitor['baseline'] = mean
+        monitor['baseline_std'] = np.sqrt(np.maximum(var, 0.0))
+        monitor['noise'] = window_mean(index['baseline_rms'])
+        monitor['occupancy'] = window_mean(amp > threshold)
+        # The quantiles need the amplitudes of each window, they are
+        # calculated for batches of windows, so that only about 2**22
+        # amplitudes are copied at a time also for overlapping windows.
+        views = np.lib.stride_tricks.sliding_window_view(amp, window) \
+                if len(firsts) else None
+        batch = max(1, (1 << 22) // window)
+        for i in range(0, len(firsts), batch):
+            monitor['amplitude'][i : i + batch] = np.quantile( \
+                views[firsts[i : i + batch]], MONITOR_QUANTILES, axis=1).T
+        if filename is not None:
+            with open(filename, 'wb') as fo:
+                np.savez(fo, monitor=monitor, window=window, step=step, \
+                         threshold=threshold, polarity=polarity, \
+                         basename=self._basename)
+        return monitor
+
+    def sample_records(self, n, start=0, stop=None, seed=None):
+        """
+        Draws a uniform random sample of *n* different record indices,
+        e.g. for a representative preview of a long run (see
+        WaveformPlot.make_plot()). The reservoir algorithm L is used, which
+        jumps over the records not taken, so only about
+        n * (1 + log(count / n)) random numbers are needed.
+
+        *n* : integer
+            Size of the sample. If the range has fewer records, all
+            records are returned, if *n* <= 0, none.
+
+        *start*, *stop* : integer, optional
+            Record range to be sampled, defaults to all records.
+
+        *seed* : integer, optional
+            Seed of the random generator, for a reproducible sample.
+
+        *return* : numpy array of int64
+            The sorted indices of the records in the sample, which can
+            be passed to read_records() or get_data().
+        """
+        if n <= 0:
+            return np.zeros(0, dtype=np.int64)
+        start, stop = self._selection(start, stop, None)
+        count = stop - start
+        if n >= count:
+            return np.arange(start, stop, dtype=np.int64)
+        rng = np.random.RandomState(seed)
+        reservoir = np.arange(n, dtype=np.int64)
+        w = np.exp(np.log(1.0 - rng.random_sample()) / n)
+        i = n - 1
+        while True:
+            i += int(np.log(1.0 - rng.random_sample()) / np.log1p(-w)) + 1
+            if i >= count:
+                break
+            reservoir[rng.randint(n)] = i
+            w *= np.exp(np.log(1.0 - rng.random_sample()) / n)
+        reservoir.sort()
+        return reservoir + start
+
+    def select_records(self, amplitude_min=None, amplitude_max=None, \
+                       polarity=1, baseline_rms_max=None, \
+                       start=0, stop=None):
+        """
+        Selects records using the record index (see build_index()), hence
+        the data-file is only read once, when the index is built. All
+        conditions are combined with a logical and. Example::
+
+            idx = sd.select_records(amplitude_min=0.02, baseline_rms_max=0.002)
+            features = sd.get_features(indices=idx)
+
+        *amplitude_min* : float, optional
+            Only records with an amplitude (distance of maximum resp.
+            minimum from the baseline) of at least *amplitude_min* V.
+
+        *amplitude_max* : float, optional
+            Only records with an amplitude of at most *amplitude_max* V,
+            e.g. to reject saturated records.
+
+        *polarity* : integer, optional
+            +1 for positive pulses (default), -1 for negative pulses.
+
+        *baseline_rms_max* : float, optional
+            Only records with a clean baseline, i.e. the RMS of the
+            baseline is at most *baseline_rms_max* V.
+
+        *start*, *stop* : integer, optional
+            Only records within this range of record indices.
+
+        *return* : numpy array of int64
+            The indices of the selected records in ascending order.
+        """
+        index = self.get_index()
+        if stop is None or stop > len(index):
+            stop = len(index)
+        index = index[start : stop]
+        if polarity < 0:
+            amp = index['baseline'] - index['min']
+        else:
+            amp = index['max'] - index['baseline']
+        mask = np.ones(len(index), dtype=bool)
+        if amplitude_min is not None:
+            mask &= amp >= amplitude_min
+        if amplitude_max is not None:
+            mask &= amp <= amplitude_max
+        if baseline_rms_max is not None:
+            mask &= index['baseline_rms'] <= baseline_rms_max
+        return np.flatnonzero(mask).astype(np.int64) + start
+
+
+    def write_records(self, indices, filename, directory='', \
+                      chunk_size=CHUNK_RECORDS):
+        """
+        Writes a skim of this data-file: a new pair of files ``xxx.bin``
+        and ``xxx.Wfm.bin`` which only contains the records with the
+        given indices. The header is copied with the number of records
+        (properties in RECORD_COUNT_PROPS) updated, the records are copied
+        chunk by chunk without loading the source data-file into memory.
+        The new files can be read with ScopeData. Example::
+
+            idx = sd.select_records(amplitude_min=0.02)
+            skim = sd.write_records(idx, 'run1_skim_raw', 'skims')
+
+        *indices* : list or numpy array of integers
+            Indices of the records to be written, in this order.
+
+        *filename* : string
+            Basename of the new files, see constructor of ScopeData.
+
+        *directory* : string, optional
+            The directory for the new files, which has to exist.
+
+        *chunk_size* : integer, optional
+            Number of records copied at once, defaults to CHUNK_RECORDS.
+
+        *return* : ScopeData
+            A ScopeData object for the new files.
+        """
+        headerfilename = directory + '/' + filename + '.bin'
+        datafilename = directory + '/' + filename + '.Wfm.bin'
+        if os.path.abspath(datafilename) in \
+           [os.path.abspath(fn) for fn in self._get_datafilenames()]:
+            msg = '??? ScopeData ERROR: skim "{}" would overwrite ' +\
+                  'the source data-file'
+            raise ValueError(msg.format(datafilename))
+        indices = np.asarray(indices, dtype=np.int64)
+        doc = et.parse(self._headerfilename)
+        for prop in doc.xpath('//Group/Prop'):
+            if prop.get('Name') in RECORD_COUNT_PROPS:
+                prop.set('Value', str(len(indices)))
+        doc.write(headerfilename, xml_declaration=True, \
+                  encoding=doc.docinfo.encoding or 'UTF-8')
+        with open(datafilename, 'wb') as fo:
+            for first, chunk in self.iter_rawdata(chunk_size, \
+                                                  indices=indices):
+                chunk.tofile(fo)
+        return ScopeData(filename, directory)
+
+
+
+    def share(self, kind='raw', backend='shm'):
+        """
+        Publishes the raw data or the converted data so that worker
+        processes can use them without copying (see class SharedScopeData).
+        Only the small *handle* returned has to be passed to the workers.
+        Example with a pool of workers::
+
+            def work(args):
+                handle, start, stop = args
+                return SharedScopeData(handle).get_features(start=start, \\
+                                                            stop=stop)
+
+            handle = sd.share()
+            jobs = [(handle, i, i + 10000) for i in range(0, 100000, 10000)]
+            features = np.concatenate(multiprocessing.Pool().map(work, jobs))
+            sd.release_shared()
+
+        *kind* : string, optional
+            'raw' (default) for the raw data (see get_rawdata()), or 'data'
+            for the converted data (see get_data()).
+
+        *backend* : string, optional
+            'shm' (default): the data are read from the data-file directly
+            into a block of ``multiprocessing.shared_memory`` (arrays which
+            are already loaded are copied), which must be released with
+            release_shared() when the workers are done.
+            'mmap': no copy at all, the workers map the data-file itself
+            into memory (only for *kind* = 'raw').
+
+        *return* : dictionary
+            The handle for the constructor of SharedScopeData.
+        """
+        handle = {'kind': kind, 'backend': backend,
+                  'props': self._props, 'datatype': self._datatype,
+                  'basename': self._basename,
+                  'headerfilename': self._headerfilename,
+                  'datafilename': self._datafilename}
+        if backend == 'mmap':
+            if kind != 'raw' or len(self._get_datafilenames()) != 1:
+                msg = '??? ScopeData ERROR: backend "mmap" is only ' +\
+                      'available for the raw data of a single data-file'
+                raise ValueError(msg)
+            handle['count'] = self.get_record_count()
+            return handle
+        if backend != 'shm':
+            msg = '??? ScopeData ERROR: unknown backend "{}"'.format(backend)
+            raise ValueError(msg)
+        count = self.get_record_count()
+        if kind == 'raw':
+            shape, dtype = (count,), self._datatype
+        elif kind == 'data':
+            shape = (count, self._props['RecordLength'])
+            dtype = np.dtype(np.float64)
+        else:
+            msg = '??? ScopeData ERROR: unknown kind "{}"'.format(kind)
+            raise ValueError(msg)
+        from multiprocessing import shared_memory
+        shm = shared_memory.SharedMemory(create=True, \
+                            size=max(count * int(np.prod(shape[1:])) * \
+                                     dtype.itemsize, 1))
+        array = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        # the data are read (or converted) directly into the shared block,
+        # only arrays which are already loaded are copied
+        if kind == 'raw' and self._rawdata is not None:
+            array[...] = self._rawdata[:count]
+        elif kind == 'raw':
+            self._read_raw_into(array)
+        elif self._data is not None:
+            array[...] = self._data[:count]
+        else:
+            cof = self._props['ConversionFactor']
+            coo = self._props['ConversionOffset']
+            for first, chunk in self.iter_rawdata(stop=count):
+                out = array[first : first + len(chunk)]
+                np.multiply(chunk['sig'], cof, out=out)
+                out += coo
+        del array
+        self._shared.append(shm)
+        handle['name'] = shm.name
+        handle['shape'] = shape
+        handle['dtype'] = dtype
+        return handle
+
+    def release_shared(self):
+        """
+        Releases all shared memory blocks created by share(). Workers must
+        not use their SharedScopeData objects afterwards.
+
+        *return* : None
+        """
+        for shm in self._shared:
+            shm.close()
+            shm.unlink()
+        self._shared = []
+        return None
+
+
+class ScopeDataSet(ScopeData):
+    """
+    This class combines several data-files of a measurement campaign
+    (pairs ``xxx_raw.bin`` and ``xxx_raw.Wfm.bin`` with identical header
+    properties) into one virtual data-file. The records of all files are
+    numbered consecutively (global indices), and all methods of ScopeData
+    (chunked iteration, features, histograms, skims, ...) as well as the
+    transient plots work on the complete campaign in one streaming pass.
+
+    To create an instance of ScopeDataSet you can use as an exmaple::
+
+        sds = ScopeDataSet(['run1_raw', 'run2_raw', 'run3_raw'], 'myDataDir')
+        hist = sds.get_persistence_histogram()
+
+    The parameter(s) provided to the constructor have the following meaning:
+
+    *filenames* : list of strings or list of ScopeData objects
+        The basenames of the data-files (see class ScopeData) or already
+        created ScopeData objects. All must have identical properties,
+        otherwise a ValueError is raised (see also group_scope_runs()).
+
+    *directory* : string, optional
+        The directory which contains the data-files, only used
+        if *filenames* contains basenames.
+    """
+
+    def __init__(self, filenames, directory=''):
+        self._sds = []
+        for fn in filenames:
+            if isinstance(fn, ScopeData):
+                self._sds.append(fn)
+            else:
+                self._sds.append(ScopeData(fn, directory))
+        if len(self._sds) == 0:
+            raise ValueError('??? ScopeDataSet ERROR: no data-files given')
+        first = self._sds[0]
+        for sd in self._sds[1:]:
+            if sd.get_props() != first.get_props():
+                msg = '??? ScopeDataSet ERROR: properties of "{}" differ ' +\
+                      'from "{}"'
+                raise ValueError(msg.format(sd.get_basename(), \
+                                            first.get_basename()))
+        self._basename = first.get_basename()
+        self._headerfilename = first._headerfilename
+        self._datafilename = None
+        self._indexfilename = None
+        self._props = first.get_props()
+        self._datatype = first._datatype
+        self._rawdata = None
+        self._data = None
+        self._screen = None
+        self._index = None
+        self._shared = []
+        return None
+        # End of the constructor
+
+    def get_members(self):
+        """
+        *return* : list of ScopeData
+            The ScopeData objects of all data-files in this data set.
+        """
+        return self._sds
+
+    def print_filenames(self):
+        """
+        Prints the filenames of all data-files
+
+        *return* : None
+        """
+        for sd in self._sds:
+            sd.print_filenames()
+        return None
+
+    def get_offsets(self):
+        """
+        *return* : numpy array of int64
+            The global index of the first record of each data-file, with
+            the total number of records appended.
+        """
+        counts = [sd.get_record_count() for sd in self._sds]
+        return np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+
+    def get_record_count(self):
+        """
+        *return* : integer
+            Number of records in all data-files.
+        """
+        return int(self.get_offsets()[-1])
+
+    def locate(self, indices):
+        """
+        Returns the provenance of records given by global indices.
+
+        *indices* : integer or list or numpy array of integers
+            Global indices of records.
+
+        *return* : two numpy arrays of int64
+            The number of the data-file (position in get_members()) and
+            the index of the record within that data-file.
+        """
+        offsets = self.get_offsets()
+        indices = np.atleast_1d(np.asarray(indices, dtype=np.int64))
+        files = np.searchsorted(offsets, indices, side='right') - 1
+        files = np.clip(files, 0, len(self._sds) - 1)
+        return files, indices - offsets[files]
+
+    def get_rawdata(self):
+        """
+        Parse all data-files and return the concatenated raw data.
+        **Caveat!** This needs as much memory as all data-files together,
+        use iter_rawdata() for large campaigns.
+
+        *return* : array of numpy-arrays
+            raw data for advanced calucations
+        """
+        if self._rawdata is None:
+            self._rawdata = np.concatenate(\
+                [sd.get_rawdata() for sd in self._sds])
+        return self._rawdata
+
+    def iter_rawdata(self, chunk_size=CHUNK_RECORDS, start=0, stop=None, \
+                     indices=None):
+        """
+        Iterates over the raw data of all data-files in chunks of at most
+        *chunk_size* records, see ScopeData.iter_rawdata(). Chunks do not
+        span several data-files, the first value yielded is the global
+        index of the first record in the chunk (or its position within
+        *indices*).
+        """
+        if indices is not None or self._rawdata is not None:
+            for item in ScopeData.iter_rawdata(self, chunk_size, start, \
+                                               stop, indices):
+                yield item
+            return
+        offsets = self.get_offsets()
+        if stop is None or stop > offsets[-1]:
+            stop = offsets[-1]
+        for i, sd in enumerate(self._sds):
+            lo = max(start, offsets[i])
+            hi = min(stop, offsets[i + 1])
+            if hi <= lo:
+                continue
+            for first, chunk in sd.iter_rawdata(chunk_size, lo - offsets[i], \
+                                                hi - offsets[i]):
+                yield int(first + offsets[i]), chunk
+
+    def _get_file_record_count(self):
+        # Number of complete records in all data-files from their sizes
+        return sum(sd._get_file_record_count() for sd in self._sds)
+
+    def _iter_file(self, chunk_size=CHUNK_RECORDS, start=0, stop=None):
+        # Like iter_rawdata(), but always read from the data-files
+        counts = [sd._get_file_record_count() for sd in self._sds]
+        offsets = np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+        if stop is None or stop > offsets[-1]:
+            stop = offsets[-1]
+        for i, sd in enumerate(self._sds):
+            lo = max(start, offsets[i])
+            hi = min(stop, offsets[i + 1])
+            if hi <= lo:
+                continue
+            for first, chunk in sd._iter_file(chunk_size, lo - offsets[i], \
+                                              hi - offsets[i]):
+                yield int(first + offsets[i]), chunk
+
+    def _get_datafilenames(self):
+        # All data-files read by this object
+        return [sd._datafilename for sd in self._sds]
+
+    def _pyramid_directory(self):
+        # Default directory of the pyramid, next to the first data-file.
+        # The name contains the number of members and a hash of all their
+        # basenames, so different data sets do not share a pyramid.
+        import hashlib
+        names = '\n'.join(sd.get_basename() for sd in self._sds)
+        digest = hashlib.sha1(names.encode('utf-8')).hexdigest()[:8]
+        return '{}_set{}_{}.pyramid'.format( \
+            self._headerfilename[:-len('.bin')], len(self._sds), digest)
+
+    def _read_raw_into(self, out):
+        # Reads the records of all data-files directly into out
+        offsets = self.get_offsets()
+        for i, sd in enumerate(self._sds):
+            sd._read_raw_into(out[offsets[i] : offsets[i + 1]])
+        return out
+
+    def read_records(self, indices, max_gap=16):
+        """
+        Reads only the records with the given global indices,
+        see ScopeData.read_records().
+        """
+        indices = np.atleast_1d(np.asarray(indices, dtype=np.int64))
+        count = self.get_record_count()
+        indices = np.where(indices < 0, indices + count, indices)
+        if len(indices) > 0 and (indices.min() < 0 or indices.max() >= count):
+            msg = '??? ScopeDataSet ERROR: record index out of range ' +\
+                  '(data set has {} records)'.format(count)
+            raise IndexError(msg)
+        if self._rawdata is not None:
+            return self._rawdata[indices]
+        records = np.empty(len(indices), dtype=self._datatype)
+        files, local = self.locate(indices)
+        for i in np.unique(files):
+            mask = files == i
+            records[mask] = self._sds[i].read_records(local[mask], max_gap)
+        return records
+
+    def build_index(self, chunk_size=CHUNK_RECORDS, save=True):
+        """
+        Builds the record index of each data-file (stored in its own
+        sidecar file), see ScopeData.build_index().
+
+        *return* : numpy array of INDEX_DTYPE
+            One line for each record of the data set.
+        """
+        self._index = np.concatenate(\
+            [sd.build_index(chunk_size, save) for sd in self._sds])
+        return self._index
+
+    def get_index(self, chunk_size=CHUNK_RECORDS):
+        """
+        Returns the record index of all data-files, see
+        ScopeData.get_index().
+
+        *return* : numpy array of INDEX_DTYPE
+            One line for each record of the data set.
+        """
+        if self._index is None or \
+           len(self._index) != self.get_record_count():
+            self._index = np.concatenate(\
+                [sd.get_index(chunk_size) for sd in self._sds])
+        return self._index
+
+
+
+
+class SharedScopeData(ScopeData):
+    """
+    This class is the worker-side counterpart of ScopeData.share(): it
+    attaches to the shared memory block (or maps the data-file) described
+    by the handle, without copying the data. All methods of ScopeData
+    working on the raw data are available. If only the converted data
+    have been shared, only get_data() can be used.
+
+    To create an instance of SharedScopeData in a worker process use::
+
+        sd = SharedScopeData(handle)
+
+    The parameter(s) provided to the constructor have the following meaning:
+
+    *handle* : dictionary
+        The handle returned by ScopeData.share().
+    """
+
+    def __init__(self, handle):
+        self._basename = handle['basename']
+        self._headerfilename = handle['headerfilename']
+        self._datafilename = handle['datafilename']
+        self._indexfilename = None
+        self._props = handle['props']
+        self._datatype = handle['datatype']
+        self._rawdata = None
+        self._data = None
+        self._screen = None
+        self._index = None
+        self._shared = []
+        self._attached = None
+        if handle['backend'] == 'mmap':
+            self._rawdata = np.memmap(self._datafilename, mode='r', \
+                dtype=self._datatype, shape=(handle['count'],))
+            return None
+        from multiprocessing import shared_memory
+        try:
+            shm = shared_memory.SharedMemory(name=handle['name'], track=False)
+        except TypeError:               # Python < 3.13
+            shm = shared_memory.SharedMemory(name=handle['name'])
+        self._attached = shm
+        array = np.ndarray(handle['shape'], dtype=handle['dtype'], \
+                           buffer=shm.buf)
+        if handle['kind'] == 'raw':
+            self._rawdata = array
+        else:
+            self._data = array
+        return None
+        # End of the constructor
+
+    def get_record_count(self):
+        """
+        *return* : integer
+            Number of records (waveforms) in the shared data.
+        """
+        if self._rawdata is not None:
+            return len(self._rawdata)
+        return len(self._data)
+
+    def get_index(self, chunk_size=CHUNK_RECORDS):
+        """
+        Returns the record index, see ScopeData.get_index(). It is built
+        in memory, no sidecar file is used.
+        """
+        if self._index is None:
+            self.build_index(chunk_size, save=False)
+        return self._index
+
+    def close(self):
+        """
+        Detaches from the shared memory block. The block itself is
+        released by ScopeData.release_shared() in the publishing process.
+
+        *return* : None
+        """
+        self._rawdata = None
+        self._data = None
+        if self._attached is not None:
+            self._attached.close()
+            self._attached = None
+        return None
+
+
+class ScopeCatalog:
+    """
+    This class maintains a local catalog (an sqlite database) of scope
+    runs. A scan finds all pairs ``xxx.bin`` / ``xxx.Wfm.bin`` below
+    a directory and parses only the header-files, the number of records is
+    calculated from the size of the data-file. Rescans are incremental:
+    only runs with a changed modification time or size are parsed again,
+    runs which have disappeared are removed. Example::
+
+        cat = ScopeCatalog()
+        cat.refresh(M_DATA_DIR + 'transient/')
+        for run in cat.query('RecordLength >= ? ORDER BY records', (5000,)):
+            print(run['basename'], run['records'], 1.0 / run['Resolution'])
+
+    The parameter(s) provided to the constructor have the following meaning:
+
+    *catalogfile* : string, optional
+        Filename of the sqlite database, defaults to CATALOG_FILE.
+        It will be created if it does not exist.
+    """
+
+    _columns_ = [('Resolution', 'REAL'), ('RecordLength', 'INTEGER'),
+                 ('XStart', 'REAL'), ('XStop', 'REAL'),
+                 ('HardwareXStart', 'REAL'), ('HardwareXStop', 'REAL'),
+                 ('SignalHardwareRecordLength', 'INTEGER'),
+                 ('LeadingSettlingSamples', 'INTEGER'),
+                 ('VerticalPosition', 'REAL'), ('VerticalScale', 'REAL'),
+                 ('VerticalOffset', 'REAL'),
+                 ('NofQuantisationLevels', 'INTEGER'),
+                 ('VerticalDivisionCount', 'INTEGER'),
+                 ('TrailingSettlingSaples', 'INTEGER'),
+                 ('ConversionFactor', 'REAL'),
+                 ('ConversionOffset', 'REAL')]   # class variable
+
+    def __init__(self, catalogfile=CATALOG_FILE):
+        import sqlite3
+        self._catalogfile = catalogfile
+        self._db = sqlite3.connect(catalogfile)
+        self._db.row_factory = sqlite3.Row
+        cols = ', '.join('{} {}'.format(c, t) for c, t in self._columns_)
+        self._db.execute('CREATE TABLE IF NOT EXISTS runs (' +
+                         'headerfile TEXT PRIMARY KEY, directory TEXT, ' +
+                         'basename TEXT, header_mtime REAL, ' +
+                         'data_mtime REAL, data_size INTEGER, ' +
+                         'records INTEGER, ' + cols + ')')
+        self._db.commit()
+        return None
+        # End of the constructor
+
+    def refresh(self, base_dir, logfile=None):
+        """
+        Scans all directories below *base_dir* for scope runs and updates
+        the catalog. Only new or modified runs (modification time or size
+        of the header-file or data-file changed) are parsed. Runs below
+        *base_dir* which no longer exist are removed from the catalog.
+
+        *base_dir* : string
+            Directory to be scanned recursively.
+
+        *logfile* : instance of an open text-file or None
+            Error messages (e.g. unreadable headers) are sent to that
+            file or printed, see log_to_file().
+
+        *return* : two integers
+            Number of runs added or updated and number of runs removed.
+        """
+        known = {}
+        prefix = os.path.join(os.path.abspath(base_dir), '')
+        for row in self._db.execute('SELECT headerfile, header_mtime, ' +
+                                    'data_mtime, data_size FROM runs'):
+            if row['headerfile'].startswith(prefix):
+                known[row['headerfile']] = (row['header_mtime'], \
+                    row['data_mtime'], row['data_size'])
+        found = set()
+        updated = 0
+        for root, dirs, files in os.walk(base_dir):
+            for name in files:
+                if not name.endswith('.Wfm.bin'):
+                    continue
+                basename = name[:-len('.Wfm.bin')]
+                directory = os.path.abspath(root)
+                headerfile = os.path.join(directory, basename + '.bin')
+                datafile = os.path.join(directory, name)
+                if not os.path.isfile(headerfile):
+                    continue
+                found.add(headerfile)
+                hstat = os.stat(headerfile)
+                dstat = os.stat(datafile)
+                state = (hstat.st_mtime, dstat.st_mtime, dstat.st_size)
+                if known.get(headerfile) == state:
+                    continue
+                try:
+                    props = read_scope_header(headerfile)
+                except (IOError, KeyError, ValueError, et.XMLSyntaxError):
+                    msg = '??? ScopeCatalog: Bad header-file {}'
+                    log_to_file(msg.format(headerfile), logfile)
+                    continue
+                records = dstat.st_size // \
+                    scope_datatype(props).itemsize
+                values = [headerfile, directory, basename] + \
+                    list(state) + [records] + \
+                    [props[c] for c, t in self._columns_]
+                self._db.execute('INSERT OR REPLACE INTO runs VALUES (' +
+                                 ', '.join(['?'] * len(values)) + ')', values)
+                updated += 1
+        removed = [hf for hf in known if hf not in found]
+        self._db.executemany('DELETE FROM runs WHERE headerfile = ?', \
+                             [(hf,) for hf in removed])
+        self._db.commit()
+        return updated, len(removed)
+
+    def query(self, where='', params=()):
+        """
+        Returns runs from the catalog. Each run is a dictionary with
+        the keys 'headerfile', 'directory', 'basename', 'header_mtime',
+        'data_mtime', 'data_size', 'records' and the properties of
+        ScopeData.get_props().
+
+        *where* : string, optional
+            SQL condition (and optional ORDER BY clause), e.g.
+            ``'RecordLength = ? AND records > ?'``. If empty, all runs are
+            returned, ordered by their header-file.
+
+        *params* : tuple, optional
+            Values for the placeholders ``?`` in *where*.
+
+        *return* : list of OrderedDict
+            The matching runs.
+        """
+        sql = 'SELECT * FROM runs'
+        if where.strip() == '':
+            sql += ' ORDER BY headerfile'
+        elif where.strip().upper().startswith('ORDER BY'):
+            sql += ' ' + where
+        else:
+            sql += ' WHERE ' + where
+        return [collections.OrderedDict(zip(row.keys(), row))
+                for row in self._db.execute(sql, params)]
+
+    def get_scope_data(self, run):
+        """
+        *run* : dictionary
+            A run as returned by query().
+
+        *return* : ScopeData
+            A ScopeData object for that run.
+        """
+        return ScopeData(run['basename'], run['directory'])
+
+    def close(self):
+        """
+        Closes the catalog database.
+
+        *return* : None
+        """
+        self._db.close()
+        return None
+
+
+class PersistenceHistogram:
+    """
+    This class accumulates a persistence histogram of scope records:
+    For each sample of a record it counts how often each ADC level
+    occured. It can be filled chunk by chunk, merged with other
+    histograms (e.g. from worker processes or from other runs of the same
+    setup), and saved to or loaded from a ``.npz``-file. Example::
+
+        hist = sd.get_persistence_histogram()
+        hist.save('run1_hist.npz')
+        hist.merge(PersistenceHistogram.load('run2_hist.npz'))
+
+    For digitizers with 12 or 16 bit a dense histogram (samples times
+    65536 levels) is very large. Therefore several ADC levels can be
+    combined into one bin (*code_bin*), and the histogram can be stored
+    sparse: only occupied cells are kept, so the memory scales with the
+    number of occupied cells, not with the full range of ADC levels.
+
+    The parameter(s) provided to the constructor have the following meaning:
+
+    *record_length* : integer
+        Number of samples per record (property 'RecordLength').
+
+    *levels* : integer, optional
+        Number of ADC levels, defaults to 256.
+
+    *offset* : integer, optional
+        Offset added to the raw ADC values to obtain the level index,
+        defaults to 128.
+
+    *code_bin* : integer, optional
+        Number of adjacent ADC levels combined into one bin, defaults to 1.
+
+    *sparse* : bool, optional
+        If True, only occupied cells are stored. Defaults to False.
+    """
+
+    def __init__(self, record_length, levels=256, offset=128, code_bin=1, \
+                 sparse=False):
+        self._record_length = int(record_length)
+        self._levels = int(levels)
+        self._offset = int(offset)
+        self._code_bin = int(code_bin)
+        self._bins = -(-self._levels // self._code_bin)
+        self._sparse = bool(sparse)
+        if self._sparse:
+            self._keys = np.zeros(0, dtype=np.int64)
+            self._counts = np.zeros(0, dtype=np.int64)
+        else:
+            self._counts = np.zeros((self._record_length, self._bins), \
+                                    dtype=np.int64)
+        self._records = 0
+        return None
+
+    def _config(self):
+        # Parameters which have to agree for merging histograms
+        return (self._record_length, self._levels, self._offset, \
+                self._code_bin)
+
+    def _cells(self, sig):
+        # Flat cell index (sample * bins + bin) of each value in sig
+        cells = sig.astype(np.int64) + self._offset
+        if self._code_bin > 1:
+            cells //= self._code_bin
+        cells += self._bins * np.arange(self._record_length, dtype=np.int64)
+        return cells
+
+    def _add_sparse(self, keys, counts):
+        # Adds occupied cells (sorted unique keys with counts)
+        keys, inverse = np.unique(np.concatenate((self._keys, keys)), \
+                                  return_inverse=True)
+        self._counts = np.bincount(inverse.ravel(), minlength=len(keys), \
+            weights=np.concatenate((self._counts, counts)))\
+            .astype(np.int64)
+        self._keys = keys
+        return None
+
+    def fill(self, sig):
+        """
+        Adds a chunk of records to the histogram.
+
+        *sig* : 2-dimensional numpy array of integers
+            Raw ADC values, one line for each record, e.g. ``chunk['sig']``.
+
+        *return* : None
+        """
+        sig = np.asarray(sig)
+        if sig.ndim == 1:
+            sig = sig[np.newaxis, :]
+        if sig.shape[1] != self._record_length:
+            msg = '??? PersistenceHistogram ERROR: record length ' +\
+                  '{} does not match {}'.format(sig.shape[1], self._record_length)
+            raise ValueError(msg)
+        cells = self._cells(sig).ravel()
+        if self._sparse:
+            keys, counts = np.unique(cells, return_counts=True)
+            self._add_sparse(keys, counts)
+        else:
+            self._counts += np.bincount(cells, \
+                minlength=self._record_length * self._bins)\
+                .reshape(self._record_length, self._bins)
+        self._records += sig.shape[0]
+        return None
+
+    def merge(self, other):
+        """
+        Adds the counts of another histogram to this histogram.
+
+        *other* : PersistenceHistogram
+            Must have the same record length, levels, offset and code_bin,
+            it may be dense or sparse.
+
+        *return* : PersistenceHistogram
+            This (updated) histogram.
+        """
+        if other._config() != self._config():
+            msg = '??? PersistenceHistogram ERROR: histograms with ' +\
+                  'different shapes cannot be merged'
+            raise ValueError(msg)
+        keys, counts = other.get_sparse()
+        if self._sparse:
+            self._add_sparse(keys, counts)
+        else:
+            self._counts.reshape(-1)[keys] += counts
+        self._records += other._records
+        return self
+
+    def __iadd__(self, other):
+        return self.merge(other)
+
+    def is_sparse(self):
+        """
+        *return* : bool
+            True if only occupied cells are stored.
+        """
+        return self._sparse
+
+    def get_sparse(self):
+        """
+        *return* : two numpy arrays of int64
+            The occupied cells (flat index sample * number of bins + bin)
+            in ascending order and their counts.
+        """
+        if self._sparse:
+            return self._keys, self._counts
+        keys = np.flatnonzero(self._counts)
+        return keys, self._counts.reshape(-1)[keys]
+
+    def get_bin_range(self):
+        """
+        *return* : two integers
+            The first and the last bin shown by SpectrumPlot: all bins for
+            a dense histogram, the occupied bins for a sparse histogram.
+        """
+        if not self._sparse:
+            return 0, self._bins - 1
+        if len(self._keys) == 0:
+            return 0, 0
+        bins = self._keys % self._bins
+        return int(bins.min()), int(bins.max())
+
+    def get_levels(self, bin_min=0, bin_max=None):
+        """
+        *bin_min*, *bin_max* : integer, optional
+            Range of bins (inclusive), defaults to all bins.
+
+        *return* : numpy array of float
+            The raw ADC value at the center of each bin.
+        """
+        if bin_max is None:
+            bin_max = self._bins - 1
+        bins = np.arange(bin_min, bin_max + 1)
+        return bins * self._code_bin - self._offset + \
+            0.5 * (self._code_bin - 1)
+
+    def get_counts(self, idx_min=0, idx_max=None, bin_min=0, bin_max=None):
+        """
+        *idx_min*, *idx_max* : integer, optional
+            Range of samples, *idx_max* excluded, defaults to all samples.
+
+        *bin_min*, *bin_max* : integer, optional
+            Range of bins, *bin_max* included, defaults to all bins.
+
+        *return* : 2-dimensional numpy array of int64
+            The counts, one line for each sample, one column for each bin.
+        """
+        if idx_max is None:
+            idx_max = self._record_length
+        if bin_max is None:
+            bin_max = self._bins - 1
+        if not self._sparse:
+            return self._counts[idx_min : idx_max, bin_min : bin_max + 1]
+        counts = np.zeros((max(idx_max - idx_min, 0), \
+                           max(bin_max + 1 - bin_min, 0)), dtype=np.int64)
+        lo, hi = np.searchsorted(self._keys, \
+            [idx_min * self._bins, idx_max * self._bins])
+        keys = self._keys[lo : hi]
+        samples = keys // self._bins - idx_min
+        bins = keys % self._bins - bin_min
+        ok = (bins >= 0) & (bins < counts.shape[1])
+        counts[samples[ok], bins[ok]] = self._counts[lo : hi][ok]
+        return counts
+
+    def get_records(self):
+        """
+        *return* : integer
+            Number of records filled into the histogram.
+        """
+        return self._records
+
+    def get_record_length(self):
+        """
+        *return* : integer
+            Number of samples per record.
+        """
+        return self._record_length
+
+    def get_max(self):
+        """
+        *return* : integer
+            The largest count of all cells, at least 1.
+        """
+        if len(self._counts) == 0:
+            return 1
+        return max(int(self._counts.max()), 1)
+
+    def get_screen(self, idx_min=0, idx_max=None, bin_min=0, bin_max=None):
+        """
+        Parameters see get_counts().
+
+        *return* : 2-dimensional numpy array of int64
+            The counts as used for the image of SpectrumPlot: Empty cells
+            are set to 1 so that they can be shown in a logarithmic scale.
+        """
+        return np.maximum(self.get_counts(idx_min, idx_max, bin_min, \
+                                          bin_max), 1)
+
+    def save(self, filename):
+        """
+        Saves the histogram in a compressed numpy file.
+
+        *filename* : string
+            Name of the file, usually ending with ``.npz``.
+
+        *return* : None
+        """
+        keys, counts = self.get_sparse()
+        np.savez_compressed(filename, keys=keys, counts=counts, \
+            record_length=self._record_length, records=self._records, \
+            levels=self._levels, offset=self._offset, \
+            code_bin=self._code_bin, sparse=self._sparse)
+        return None
+
+    @classmethod
+    def load(cls, filename):
+        """
+        Loads a histogram saved with save().
+
+        *filename* : string
+            Name of the file, usually ending with ``.npz``.
+
+        *return* : PersistenceHistogram
+            The loaded histogram.
+        """
+        with np.load(filename) as npz:
+            hist = cls(int(npz['record_length']), int(npz['levels']), \
+                       int(npz['offset']), int(npz['code_bin']), \
+                       bool(npz['sparse']))
+            if hist._sparse:
+                hist._keys = npz['keys']
+                hist._counts = npz['counts']
+            else:
+                hist._counts.reshape(-1)[npz['keys']] = npz['counts']
+            hist._records = int(npz['records'])
+        return hist
+
+
+
+class HistogramPyramid:
+    """
+    This class holds a pyramid of persistence histograms on disk:
+    level 0 has the full sample resolution, each further level combines
+    *factor* adjacent samples of the level below, until a level has at
+    most *factor* columns. Each level is stored as a ``.npy``-file
+    in *directory* and is mapped into memory when used, so for any window
+    of samples only a small part of one level has to be read. This makes
+    interactive pan and zoom of SpectrumPlot fast also for long records.
+
+    A pyramid is built once per run with ScopeData.build_pyramid() and
+    can then be opened as often as needed; ScopeData.get_pyramid() opens
+    it if it is still valid and builds it only otherwise::
+
+        pyr = sd.get_pyramid()      # streaming pass over the run, once
+        counts, first, step = pyr.get_window(0, 100000, max_columns=1000)
+
+    The parameter(s) provided to the constructor have the following meaning:
+
+    *directory* : string
+        The directory which contains the pyramid.
+    """
+
+    def __init__(self, directory):
+        self._directory = directory
+        try:
+            with np.load(os.path.join(directory, 'pyramid.npz')) as npz:
+                self._factor = int(npz['factor'])
+                self._record_length = int(npz['record_length'])
+                self._records = int(npz['records'])
+                self._nlevels = int(npz['nlevels'])
+                self._adc_levels = npz['adc_levels']
+                self._max = int(npz['max']) if 'max' in npz else None
+                self._code_bin = int(npz['code_bin']) \
+                                 if 'code_bin' in npz else None
+                self._sources = [(str(name), int(size), float(mtime)) \
+                    for name, size, mtime in zip(npz['source_names'], \
+                    npz['source_sizes'], npz['source_mtimes'])] \
+                    if 'source_names' in npz else None
+        except (IOError, OSError, KeyError):
+            msg = '??? HistogramPyramid ERROR: Class HistogramPyramid ' +\
+                  'could not be instanciated:\n' +\
+                  'Directory "{}" contains no pyramid'.format(directory)
+            raise IOError(msg)
+        self._levels = [None] * self._nlevels
+        return None
+        # End of the constructor
+
+    @classmethod
+    def build(cls, hist, directory, factor=2, datafilenames=None):
+        """
+        Builds a pyramid from a persistence histogram and writes it into
+        *directory*, which is created if necessary. Only the occupied range
+        of bins of *hist* (see PersistenceHistogram.get_bin_range()) is
+        stored.
+
+        *hist* : PersistenceHistogram
+            The histogram with full sample resolution.
+
+        *directory* : string
+            The directory for the pyramid files.
+
+        *factor* : integer, optional
+            Number of samples combined from one level to the next,
+            defaults to 2. Must be at least 2, otherwise a ValueError
+            is raised.
+
+        *datafilenames* : list of strings, optional
+            The data-files of *hist*. Their size and modification time are
+            stored with the pyramid for is_current().
+
+        *return* : HistogramPyramid
+            The new pyramid.
+        """
+        factor = cls._check_factor(factor)
+        if datafilenames is None:
+            datafilenames = []
+        stats = [os.stat(fn) for fn in datafilenames]
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        bin_min, bin_max = hist.get_bin_range()
+        counts = hist.get_counts(bin_min=bin_min, bin_max=bin_max)
+        count_max = int(counts.max()) if counts.size > 0 else 0
+        nlevels = 0
+        while True:
+            np.save(os.path.join(directory, 'level_{}.npy'.format(nlevels)), \
+                    counts)
+            nlevels += 1
+            if len(counts) <= factor:
+                break
+            pad = -len(counts) % factor
+            if pad > 0:
+                counts = np.concatenate((counts, \
+                    np.zeros((pad, counts.shape[1]), dtype=counts.dtype)))
+            counts = counts.reshape(-1, factor, counts.shape[1]).sum(axis=1)
+        np.savez(os.path.join(directory, 'pyramid.npz'), factor=factor, \
+                 record_length=hist.get_record_length(), \
+                 records=hist.get_records(), \
+                 nlevels=nlevels, adc_levels=hist.get_levels(bin_min, bin_max), \
+                 max=count_max, code_bin=hist._code_bin, \
+                 source_names=np.array([os.path.abspath(fn) \
+                                        for fn in datafilenames], dtype=str), \
+                 source_sizes=np.array([st.st_size for st in stats], \
+                                       dtype=np.int64), \
+                 source_mtimes=np.array([st.st_mtime for st in stats], \
+                                        dtype=np.float64))
+        return cls(directory)
+
+    @staticmethod
+    def _check_factor(factor):
+        # Returns factor as integer, raises a ValueError if it is no
+        # integer >= 2 (the levels would not get smaller)
+        if int(factor) != factor or factor < 2:
+            msg = '??? HistogramPyramid ERROR: factor must be an ' +\
+                  'integer >= 2, got {}'
+            raise ValueError(msg.format(factor))
+        return int(factor)
+
+    def get_level(self, level):
+        """
+        *level* : integer
+            Number of the level, 0 is the full sample resolution.
+
+        *return* : 2-dimensional numpy array of int64 (memory mapped)
+            The counts of this level, one line for each group of
+            *factor* ** *level* samples, one column for each bin.
+        """
+        if self._levels[level] is None:
+            self._levels[level] = np.load(os.path.join(self._directory, \
+                'level_{}.npy'.format(level)), mmap_mode='r')
+        return self._levels[level]
+
+    def get_adc_levels(self):
+        """
+        *return* : numpy array of float
+            The raw ADC value at the center of each stored bin.
+        """
+        return self._adc_levels
+
+    def get_records(self):
+        """
+        *return* : integer
+            Number of records in the histogram.
+        """
+        return self._records
+
+    def get_factor(self):
+        """
+        *return* : integer
+            Number of samples combined from one level to the next.
+        """
+        return self._factor
+
+    def get_code_bin(self):
+        """
+        *return* : integer or None
+            Number of ADC codes per bin, None for pyramids built without
+            this information.
+        """
+        return self._code_bin
+
+    def get_max(self):
+        """
+        *return* : integer
+            The largest count of level 0, e.g. for the color scale. It is
+            stored with the pyramid, for older pyramids it is calculated
+            once from level 0.
+        """
+        if self._max is None:
+            self._max = int(self.get_level(0).max())
+        return self._max
+
+    def is_current(self, datafilenames):
+        """
+        *datafilenames* : list of strings
+            The data-files the pyramid should represent.
+
+        *return* : boolean
+            True if the pyramid was built from exactly these data-files
+            and their size and modification time are unchanged.
+        """
+        if self._sources is None or \
+           len(self._sources) != len(datafilenames):
+            return False
+        for (name, size, mtime), fn in zip(self._sources, datafilenames):
+            if name != os.path.abspath(fn) or not os.path.isfile(fn):
+                return False
+            stat = os.stat(fn)
+            if stat.st_size != size or stat.st_mtime != mtime:
+                return False
+        return True
+
+    def choose_level(self, idx_min, idx_max, max_columns=1000):
+        """
+        Returns the finest level which shows the samples from *idx_min*
+        to *idx_max* with at most *max_columns* columns.
+
+        *return* : integer
+            Number of the level.
+        """
+        level = 0
+        n = max(idx_max - idx_min, 1)
+        while level < self._nlevels - 1 and \
+              -(-n // self._factor**level) > max_columns:
+            level += 1
+        return level
+
+    def get_window(self, idx_min, idx_max, max_columns=1000):
+        """
+        Returns the counts for a window of samples from the level chosen by
+        choose_level(). Only this part of the level is read from disk.
+
+        *idx_min*, *idx_max* : integer
+            Range of samples, *idx_max* excluded.
+
+        *max_columns* : integer, optional
+            Maximum number of columns (e.g. the width of the plot in
+            pixels), defaults to 1000.
+
+        *return* : 2-dimensional numpy array, integer, integer
+            The counts (one line for each column), the first sample of the
+            first column and the number of samples per column. The counts
+            have no lines if the window is outside of the record.
+        """
+        idx_min = max(int(idx_min), 0)
+        idx_max = max(min(int(idx_max), self._record_length), idx_min)
+        level = self.choose_level(idx_min, idx_max, max_columns)
+        step = self._factor**level
+        lo = idx_min // step
+        hi = -(-idx_max // step)
+        return np.array(self.get_level(level)[lo : hi]), lo * step, step
+
+
+class WaveformFilter:
+    """
+    This class is the base of the digital shaping filters, which can be
+    passed (parameter *filt*) to the analysis methods of ScopeData, e.g.::
+
+        feat = sd.get_features(filt=CRRCFilter(50e-9, order=4))
+        hist = sd.get_persistence_histogram(filt=MovingAverageFilter(8))
+
+    A filter is a causal convolution of each record with a kernel
+    (impulse response). It is applied to a whole chunk of records at once:
+    short kernels are convolved directly, long kernels by FFT. The filtered
+    records have the same length as the raw records, the samples before
+    the start of a record are taken as zero (i.e. the baseline).
+
+    The parameter(s) provided to the constructor have the following meaning:
+
+    *kernel* : list or numpy array of float
+        The impulse response of the filter, one value per sample.
+    """
+
+    _direct_taps = 16          # longer kernels are applied by FFT
+
+    def __init__(self, kernel):
+        self._kernel = np.asarray(kernel, dtype=np.float32).ravel()
+        if len(self._kernel) == 0:
+            raise ValueError('??? WaveformFilter ERROR: empty kernel')
+        return None
+        # End of the constructor
+
+    def get_kernel(self, dt=None, length=None):
+        """
+        Returns the kernel of the filter.
+
+        *dt* : float, optional
+            Time between two samples in s. Only needed for filters which
+            are defined by time constants (e.g. CRRCFilter).
+
+        *length* : integer, optional
+            If given, the kernel is truncated to at most *length* samples.
+
+        *return* : numpy array of float32
+        """
+        return self._kernel[:length]
+
+    def apply(self, s, dt=None):
+        """
+        Filters a chunk of records.
+
+        *s* : numpy array
+            The records, one record per line (or a single record).
+
+        *dt* : float, optional
+            Time between two samples in s, see get_kernel().
+
+        *return* : numpy array of float32
+            The filtered records, same shape as *s*.
+        """
+        s = np.asarray(s, dtype=np.float32)
+        rl = s.shape[-1]
+        k = self.get_kernel(dt, rl)
+        if len(k) <= self._direct_taps:
+            out = s * k[0]
+            for j in range(1, len(k)):
+                out[..., j:] += k[j] * s[..., :rl - j]
+            return out
+        nfft = 1 << int(rl + len(k) - 2).bit_length()
+        spec = np.fft.rfft(s, nfft, axis=-1)
+        spec *= np.fft.rfft(k, nfft)
+        return np.fft.irfft(spec, nfft, axis=-1)[..., :rl].astype(np.float32)
+
+
+class MovingAverageFilter(WaveformFilter):
+    """
+    Moving average over the last *n* samples (a simple low pass, which
+    keeps the amplitude of slow signals).
+
+    *n* : integer
+        Number of samples averaged, at least 1.
+    """
+
+    def __init__(self, n):
+        if int(n) < 1:
+            msg = '??? MovingAverageFilter ERROR: n must be >= 1'
+            raise ValueError(msg)
+        WaveformFilter.__init__(self, np.full(int(n), 1.0 / int(n)))
+        return None
+        # End of the constructor
+
+
+class FIRFilter(WaveformFilter):
+    """
+    Finite impulse response filter with arbitrary coefficients, e.g. a
+    matched filter built from an averaged pulse.
+
+    *taps* : list or numpy array of float
+        The filter coefficients, *taps[0]* acts on the current sample.
+    """
+
+    def __init__(self, taps):
+        WaveformFilter.__init__(self, taps)
+        return None
+        # End of the constructor
+
+
+class CRRCFilter(WaveformFilter):
+    """
+    CR-RC^n shaper as used in spectroscopy amplifiers: one differentiator
+    and *order* integrators, all with the time constant *tau*. The response
+    to a step is (t/tau)^n * exp(-t/tau) / n!; it is scaled so that a step
+    of height 1 gives a pulse with height 1, peaking at t = n * tau.
+
+    *tau* : float
+        Shaping time constant in s.
+
+    *order* : integer, optional
+        Number of integrators n, defaults to 1.
+    """
+
+    def __init__(self, tau, order=1):
+        if tau <= 0 or order < 1:
+            msg = '??? CRRCFilter ERROR: tau must be > 0 and order >= 1'
+            raise ValueError(msg)
+        self._tau = float(tau)
+        self._order = int(order)
+        self._kernels = {}
+        return None
+        # End of the constructor
+
+    def get_kernel(self, dt=None, length=None):
+        if dt is None:
+            raise ValueError('??? CRRCFilter ERROR: dt is needed')
+        n = self._order
+        # the step response has decayed to < 1e-6 of its peak at t_max
+        t_max = (n + 14 + 4 * np.sqrt(n)) * self._tau
+        nk = max(int(np.ceil(t_max / dt)) + 1, 2)
+        if length is not None:
+            nk = min(nk, max(length, 1))
+        key = (dt, nk)
+        if key not in self._kernels:
+            x = np.arange(nk) * dt / self._tau
+            step = x ** n * np.exp(n - x) / float(n) ** n
+            self._kernels[key] = np.diff(step, prepend=0.0) \
+                                   .astype(np.float32)
+        return self._kernels[key]
+
+
+def _last_crossing(s, level, before, interpolation='linear'):
+    # Fractional sample index where each line of s last crosses *level*
+    # upwards before the sample index *before*, NaN if there is no crossing.
+    # The position between the samples is interpolated linear or with a
+    # parabola through the neighbouring samples.
+    rl = s.shape[1]
+    idx = np.arange(rl)
+    level = np.reshape(level, (-1, 1))
+    below = (s < level) & (idx < np.reshape(before, (-1, 1)))
+    k = np.where(below, idx, -1).max(axis=1)
+    rows = np.arange(len(s))
+    level = level[:, 0]
+    y0 = s[rows, k] - level
+    y1 = s[rows, np.minimum(k + 1, rl - 1)] - level
+    with np.errstate(divide='ignore', invalid='ignore'):
+        frac = np.where(y1 > y0, -y0 / (y1 - y0), 0.0)
+        if interpolation == 'parabolic':
+            ym = s[rows, np.maximum(k - 1, 0)] - level
+            a = 0.5 * (y1 + ym) - y0
+            b = 0.5 * (y1 - ym)
+            disc = b * b - 4.0 * a * y0
+            root = -2.0 * y0 / (b + np.sqrt(np.maximum(disc, 0.0)))
+            ok = (k > 0) & (disc >= 0) & (root >= 0.0) & (root <= 1.0)
+            frac = np.where(ok, root, frac)
+        elif interpolation != 'linear':
+            msg = '??? ScopeData ERROR: unknown interpolation ' +\
+                  '"{}"'.format(interpolation)
+            raise ValueError(msg)
+    return np.where(k >= 0, k + frac, np.nan)
+
+def _xcorr_shift(s, template):
+    # Fractional shift in samples of each line of s relative to template,
+    # from the maximum of the cross-correlation (batched FFT) with parabolic
+    # interpolation around the maximum.
+    rl = s.shape[1]
+    n = 2 * rl
+    corr = np.fft.irfft(np.fft.rfft(s, n, axis=1) * \
+                        np.conj(np.fft.rfft(template, n)), n, axis=1)
+    corr = np.roll(corr, rl - 1, axis=1)[:, : 2 * rl - 1]   # lags -rl+1..rl-1
+    k = np.clip(corr.argmax(axis=1), 1, 2 * rl - 3)
+    rows = np.arange(len(s))
+    cm, c0, cp = corr[rows, k - 1], corr[rows, k], corr[rows, k + 1]
+    denom = cm - 2.0 * c0 + cp
+    with np.errstate(divide='ignore', invalid='ignore'):
+        frac = np.where(denom < 0, 0.5 * (cm - cp) / denom, 0.0)
+    return k + frac - (rl - 1)
+
+
+def _normalize_records(s):
+    # Records (one per line) shifted to mean 0 and scaled to norm 1 as
+    # float32, records without any variation become 0.
+    s = np.asarray(s, dtype=np.float32)
+    s = s - s.mean(axis=1, keepdims=True)
+    norm = np.sqrt((s**2).sum(axis=1, keepdims=True))
+    return np.divide(s, norm, out=np.zeros_like(s), where=norm > 0)
+
+
+def read_scope_header(headerfilename):
+    """
+    Parses only the xml header-file ``xxx.bin`` of a scope run and returns
+    the properties which are used by ScopeData (see ScopeData.get_props()),
+    the data-file is not touched. Parameter:
+
+    *headerfilename* : string
+        Full name of the header-file.
+
+    *return* : OrderedDict
+        Important properties as evaluated from the xml header-file.
+    """
+    doc = et.parse(headerfilename)
+    values = {}
+    for prop in doc.xpath('//Group/Prop'):
+        values.setdefault(prop.get('Name'), prop.get('Value'))
+    props = collections.OrderedDict()
+    props['Resolution'] = float(values['Resolution'])
+    rl = int(values['RecordLength'])
+    props['RecordLength'] = rl
+    props['XStart'] = float(values['XStart'])
+    props['XStop'] = float(values['XStop'])
+    props['HardwareXStart'] = float(values['HardwareXStart'])
+    props['HardwareXStop'] = float(values['HardwareXStop'])
+    shl = int(values['SignalHardwareRecordLength'])
+    props['SignalHardwareRecordLength'] = shl
+    lss = int(values['LeadingSettlingSamples'])
+    props['LeadingSettlingSamples'] = lss
+    vpos = float(values['VerticalPosition'])
+    props['VerticalPosition'] = vpos
+    vscal = float(values['VerticalScale'])
+    props['VerticalScale'] = vscal
+    voff = float(values['VerticalOffset'])
+    props['VerticalOffset'] = voff
+    noql = int(values['NofQuantisationLevels'])
+    props['NofQuantisationLevels'] = noql
+    vdc = int(values['VerticalDivisionCount'])
+    props['VerticalDivisionCount'] = vdc
+    tss = shl - rl - lss
+    props['TrailingSettlingSaples'] = tss
+    cof = vscal * vdc / noql
+    props['ConversionFactor'] = cof
+    coo = voff - vpos * vscal
+    props['ConversionOffset'] = coo
+    return props
+
+def scope_datatype(props):
+    """
+    Returns the record layout of a data-file ``xxx.Wfm.bin``: leading
+    settling samples ('pre'), the record itself ('sig') and trailing
+    settling samples ('aff'). Parameter:
+
+    *props* : dictionary
+        Properties as returned by read_scope_header().
+
+    *return* : numpy dtype
+        Structured dtype of one record, the type of the samples is
+        selected by scope_sampletype().
+    """
+    sample = scope_sampletype(props)
+    return np.dtype([('pre', sample, props['LeadingSettlingSamples']),
+                     ('sig', sample, props['RecordLength']),
+                     ('aff', sample, props['TrailingSettlingSaples'])])
+
+def scope_sampletype(props):
+    """
+    Returns the type of one sample, selected by the number of quantisation
+    levels of the scope: 8 bit integers for up to 256 levels, 16 bit
+    integers (little endian) for high resolution modes with up to 65536
+    levels, otherwise 32 bit integers. Parameter:
+
+    *props* : dictionary
+        Properties as returned by read_scope_header().
+
+    *return* : numpy dtype
+        Type of one sample.
+    """
+    noql = props['NofQuantisationLevels']
+    if noql <= 256:
+        return np.dtype(np.int8)
+    elif noql <= 65536:
+        return np.dtype('<i2')
+    return np.dtype('<i4')
+
+def group_scope_runs(filenames, directory=''):
+    """
+    Groups data-files with identical header properties into data sets.
+    Parameters:
+
+    *filenames* : list of strings
+        The basenames of the data-files, see class ScopeData.
+
+    *directory* : string, optional
+        The directory which contains the data-files.
+
+    *return* : list of ScopeDataSet
+        One ScopeDataSet for each set of compatible data-files, in the
+        order of their first appearance in *filenames*.
+    """
+    groups = []
+    for fn in filenames:
+        sd = ScopeData(fn, directory)
+        for group in groups:
+            if group[0].get_props() == sd.get_props():
+                group.append(sd)
+                break
+        else:
+            groups.append([sd])
+    return [ScopeDataSet(group) for group in groups]
+
+def load_monitor(filename):
+    """
+    Reads a monitor saved by ScopeData.get_monitor().
+
+    *filename* : string
+        The ``.npz``-file of the monitor.
+
+    *return* : numpy array of MONITOR_DTYPE
+    """
+    with np.load(filename) as npz:
+        return npz['monitor']
+
+
+def _landau_table():
+    # Standard Landau density (as CERNLIB DENLAN / ROOT TMath::Landau)
+    #   p(x) = 1/pi * int_0^inf exp(-t*ln(t) - x*t) * sin(pi*t) dt
+    # tabulated once by midpoint quadrature: densely around the peak,
+    # geometrically in the 1/x**2 tail. Below x = -3.8, p(x) < 1e-5.
+    global _LANDAU_TABLE
+    if _LANDAU_TABLE is None:
+        x = np.concatenate([np.arange(-3.8, 20.0, 0.01), \
+                            20.0 * np.exp(np.arange(0.002, 4.0, 0.002))])
+        tau = (np.arange(2000) + 0.5) / 2000
+        p = np.empty_like(x)
+        for i in range(0, len(x), 500):
+            xx = x[i : i + 500, np.newaxis]
+            t_max = 60.0 / np.maximum(xx + 3.0, 1.0)
+            t = tau * t_max
+            f = np.exp(-t * np.log(t) - xx * t) * np.sin(np.pi * t)
+            p[i : i + 500] = f.mean(axis=1) * t_max[:, 0] / np.pi
+        _LANDAU_TABLE = x, np.maximum(p, 0.0)
+    return _LANDAU_TABLE
+
+def landau_pdf(x):
+    """
+    The standard Landau density (location 0, scale 1, most probable
+    value at -0.22278), vectorized by interpolation in a table.
+
+    *x* : float or numpy array of float
+
+    *return* : numpy array of float
+    """
+    xt, pt = _landau_table()
+    x = np.asarray(x, dtype=np.float64)
+    # asymptotic 1/x**2 tail beyond the table
+    tail = 1.0 / np.maximum(x, xt[-1])**2 * (xt[-1]**2 * pt[-1])
+    return np.where(x > xt[-1], tail, np.interp(x, xt, pt, left=0.0))
+
+def landau_gauss(x, norm, mpv, width, sigma):
+    """
+    Landau density convolved with a Gaussian, as used for the charge
+    spectra of silicon sensors. The convolution is done by FFT on a
+    uniform grid covering *x*, so a whole spectrum is evaluated at once.
+
+    *x* : numpy array of float
+        Where the function is evaluated (e.g. bin centres), ascending.
+
+    *norm* : float
+        Integral of the function (e.g. number of entries).
+
+    *mpv* : float
+        Most probable value of the Landau part.
+
+    *width* : float
+        Scale parameter of the Landau part (its FWHM is about 4 * *width*).
+
+    *sigma* : float
+        Standard deviation of the Gaussian.
+
+    *return* : numpy array of float
+        *norm* times the density at *x*.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    width, sigma = abs(width), abs(sigma)
+    x0 = mpv - _LANDAU_MODE * width
+    if sigma == 0.0 or len(x) == 0:
+        return norm / width * landau_pdf((x - x0) / width)
+    reach = 8.0 * sigma
+    span = x[-1] - x[0] + 2.0 * reach
+    h = max(min(width, sigma) / 5.0, span / 16384)
+    nk = int(reach / h)
+    grid = x[0] - nk * h + h * np.arange(int((x[-1] - x[0]) / h) + 2 * nk + 2)
+    land = landau_pdf((grid - x0) / width) / width
+    kernel = np.exp(-0.5 * (h * np.arange(-nk, nk + 1) / sigma)**2)
+    kernel /= kernel.sum()
+    n = 1 << int(len(grid) + len(kernel) - 2).bit_length()
+    conv = np.fft.irfft(np.fft.rfft(land, n) * np.fft.rfft(kernel, n), n)
+    # 'valid' part: grid points with the full kernel inside the grid
+    valid = conv[2 * nk : len(grid)]
+    return norm * np.interp(x, grid[nk : len(grid) - nk], valid)
+
+def _levenberg_marquardt(func, p0, y, weights, max_iter=100, tol=1e-8):
+    # Minimizes sum(weights * (y - func(p))**2) with the Levenberg-
+    # Marquardt algorithm, derivatives by finite differences. The
+    # parameters are scaled by their start values, as they may differ by
+    # many orders of magnitude (e.g. counts and charges in V*s).
+    # Returns the parameters, their covariance matrix and the chi2.
+    scale = np.abs(np.array(p0, dtype=np.float64))
+    scale[scale == 0] = 1.0
+    p = np.ones(len(scale))
+    sw = np.sqrt(weights)
+    r = sw * (y - func(p * scale))
+    chi2 = r.dot(r)
+    lam = 1e-3
+    for it in range(max_iter):
+        jac = np.empty((len(y), len(p)))
+        f0 = func(p * scale)
+        for k in range(len(p)):
+            q = p.copy()
+            q[k] += 1e-6
+            jac[:, k] = sw * (func(q * scale) - f0) / 1e-6
+        a = jac.T.dot(jac)
+        g = jac.T.dot(r)
+        while True:
+            step = np.linalg.lstsq(a + lam * np.diag(np.diag(a)), g, \
+                                   rcond=None)[0]
+            r_new = sw * (y - func((p + step) * scale))
+            chi2_new = r_new.dot(r_new)
+            if chi2_new <= chi2 or lam > 1e10:
+                break
+            lam *= 10.0
+        if chi2_new > chi2:
+            break
+        p += step
+        r = r_new
+        converged = chi2 - chi2_new <= tol * chi2
+        chi2 = chi2_new
+        lam = max(lam / 10.0, 1e-12)
+        if converged:
+            break
+    return p * scale, np.linalg.pinv(a) * np.outer(scale, scale), chi2
+
+def fit_landau_gauss(counts, edges, p0=None, fit_range=None, max_iter=100):
+    """
+    Fits the Landau-Gauss convolution landau_gauss() to a histogram,
+    e.g. a charge spectrum from ScopeData.get_charge_histogram().
+    The chi2 is minimized with Poisson weights (1 / counts, empty bins
+    weight 1) by a Levenberg-Marquardt iteration. A typical spectrum is
+    fitted within milliseconds.
+
+    *counts*, *edges* : numpy arrays
+        The histogram as returned by ``numpy.histogram()``.
+
+    *p0* : list of 4 floats, optional
+        Start values (norm, mpv, width, sigma). If None, they are
+        estimated from the histogram.
+
+    *fit_range* : (float, float), optional
+        Only bins with centres in this range are fitted, e.g. to exclude
+        the pedestal of empty records.
+
+    *max_iter* : integer, optional
+        Maximum number of iterations, defaults to 100.
+
+    *return* : two numpy arrays and a float
+        The parameters (norm, mpv, width, sigma), their errors and
+        the chi2 per degree of freedom.
+    """
+    counts = np.asarray(counts, dtype=np.float64)
+    edges = np.asarray(edges, dtype=np.float64)
+    centres = 0.5 * (edges[1:] + edges[:-1])
+    bin_width = edges[1] - edges[0]
+    if fit_range is not None:
+        sel = (centres >= fit_range[0]) & (centres <= fit_range[1])
+        counts, centres = counts[sel], centres[sel]
+    if p0 is None:
+        i_max = counts.argmax()
+        above = np.nonzero(counts >= 0.5 * counts[i_max])[0]
+        fwhm = max((above[-1] - above[0] + 1) * bin_width, bin_width)
+        p0 = (counts.sum() * 1.2, centres[i_max], \
+              fwhm / 6.0, fwhm / 6.0)
+
+    def model(p):
+        return bin_width * landau_gauss(centres, *p)
+
+    p, cov, chi2 = _levenberg_marquardt(model, p0, counts, \
+                        1.0 / np.maximum(counts, 1.0), max_iter)
+    p[2:] = np.abs(p[2:])
+    ndf = max(len(counts) - len(p), 1)
+    return p, np.sqrt(np.abs(np.diag(cov))), chi2 / ndf
+
+def _charge_spectrum_worker(args):
+    # Worker for fit_charge_spectra, runs in a separate process
+    filename, directory, hist_kwargs, fit_range = args
+    sd = ScopeData(filename, directory)
+    counts, edges = sd.get_charge_histogram(**hist_kwargs)
+    p, err, chi2_ndf = fit_landau_gauss(counts, edges, fit_range=fit_range)
+    return [sd.get_basename(), int(counts.sum())] + \
+           ['{:.6g}'.format(v) for pe in zip(p[1:], err[1:]) for v in pe] + \
+           ['{:.4g}'.format(chi2_ndf)]
+
+def fit_charge_spectra(filenames, directory='', results_file=None, \
+                       processes=None, fit_range=None, **kwargs):
+    """
+    Histograms and fits the charge spectra of many runs in parallel
+    (one worker process per run at a time) and writes a compact results
+    table, one line per run. Parameters:
+
+    *filenames* : list of strings
+        The basenames of the data-files, see class ScopeData.
+
+    *directory* : string, optional
+        The directory which contains the data-files.
+
+    *results_file* : string, optional
+        If given, the table is written to this file (tab separated,
+        see file_utils.logfile()).
+
+    *processes* : integer, optional
+        Number of worker processes, defaults to the number of CPUs.
+
+    *fit_range* : (float, float), optional
+        See fit_landau_gauss().
+
+    *kwargs* : optional
+        Passed to ScopeData.get_charge_histogram(), e.g. *bins*,
+        *range*, *window* or *polarity*.
+
+    *return* : list of lists
+        The lines of the table: basename, entries, mpv, mpv error, width,
+        width error, sigma, sigma error and chi2 per degree of freedom.
+    """
+    import multiprocessing
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    jobs = [(filename, directory, kwargs, fit_range) for filename in filenames]
+    pool = multiprocessing.Pool(max(1, min(processes, len(jobs))))
+    try:
+        lines = pool.map(_charge_spectrum_worker, jobs)
+    finally:
+        pool.close()
+        pool.join()
+    if results_file is not None:
+        title = ['basename', 'entries', 'mpv', 'mpv_err', 'width', \
+                 'width_err', 'sigma', 'sigma_err', 'chi2_ndf']
+        logfile(results_file, title, lines)
+    return lines
+
+def _persistence_histogram_worker(args):
+    # Worker for parallel_persistence_histogram, runs in a separate process
+    filename, directory, start, stop, chunk_size, code_bin, sparse = args
+    sd = ScopeData(filename, directory)
+    return sd.get_persistence_histogram(chunk_size, start, stop, \
+                                        code_bin=code_bin, sparse=sparse)
+
+def parallel_persistence_histogram(filename, directory='', processes=None, \
+                                   chunk_size=CHUNK_RECORDS, code_bin=1, \
+                                   sparse=None):
+    """
+    Creates the persistence histogram of a data-file using several
+    worker processes. Each worker histograms a contiguous range of records,
+    the partial histograms are merged afterwards. Parameters:
+
+    *filename* : string
+        The basename of the data-files, see class ScopeData.
+
+    *directory* : string, optional
+        The directory which contains the data-files.
+
+    *processes* : integer, optional
+        Number of worker processes, defaults to the number of CPUs.
+
+    *chunk_size* : integer, optional
+        Number of records per chunk within each worker.
+
+    *code_bin*, *sparse* : optional
+        See ScopeData.get_persistence_histogram().
+
+    *return* : PersistenceHistogram
+        The histogram of all records.
+    """
+    import multiprocessing
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    sd = ScopeData(filename, directory)
+    count = sd.get_record_count()
+    bounds = np.linspace(0, count, processes + 1).astype(int)
+    jobs = [(filename, directory, bounds[i], bounds[i + 1], chunk_size, \
+             code_bin, sparse)
+            for i in range(processes) if bounds[i + 1] > bounds[i]]
+    pool = multiprocessing.Pool(processes)
+    try:
+        hists = pool.map(_persistence_histogram_worker, jobs)
+    finally:
+        pool.close()
+        pool.join()
+    hist = sd.new_persistence_histogram(code_bin, sparse)
+    for other in hists:
+        hist.merge(other)
+    return hist